@@ -1,21 +1,32 @@
 import logging
 import asyncio
-from aiogram import Bot, Dispatcher
-from handlers import friends, wishlist
+from bot import create_bot, create_dispatcher
+from database.engine import create_engine
+from webhook import run_webhook
+from workers import run_sharded
 from dotenv import dotenv_values
 
 
 config = dotenv_values('.env')
-BOT_TOKEN = config['BOT_TOKEN']
 
 
 async def main():
-    bot = Bot(token=BOT_TOKEN, parse_mode="HTML")
+    bot = create_bot(config)
     logging.basicConfig(level=logging.INFO)
-    dp = Dispatcher()
-    dp.include_routers(wishlist.router, friends.router)
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    engine = create_engine(config)
+    dp = create_dispatcher(config, engine)
+    try:
+        if int(config.get('BOT_WORKERS') or 1) > 1:
+            await run_sharded(dp, bot, config)
+        elif config.get('BOT_MODE') == 'webhook':
+            await run_webhook(dp, bot, config)
+        else:
+            await bot.delete_webhook(
+                drop_pending_updates=config.get('DROP_PENDING_UPDATES') == 'true'
+            )
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        await engine.dispose()
 
 
 if __name__ == '__main__':
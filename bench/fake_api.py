@@ -0,0 +1,66 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+from aiohttp import web
+
+
+class FakeBotAPI:
+    # Answers Bot API calls the way Telegram would, closely enough for
+    # the bot to go on, and counts them
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+        self._runner = None
+        self.base_url = None
+
+    def message(self, data):
+        chat_id = int(data.get('chat_id') or 0)
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': data.get('text') or data.get('caption') or '',
+        }
+
+    def result(self, method, data):
+        if method == 'getMe':
+            return {'id': 42, 'is_bot': True, 'first_name': 'Bench',
+                    'username': 'bench_bot'}
+        if method == 'getUpdates':
+            return []
+        if method in ('sendMessage', 'sendPhoto', 'sendDocument',
+                      'editMessageText', 'editMessageCaption'):
+            return self.message(data)
+        if method == 'sendMediaGroup':
+            media = json.loads(data.get('media') or '[]')
+            return [self.message(data) for _ in media]
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        if request.content_type == 'application/json':
+            data = await request.json()
+        else:
+            data = dict(await request.post())
+
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({'ok': True, 'result': self.result(method, data)})
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host=host, port=port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = 'http://{}:{}'.format(host, port)
+
+    async def stop(self):
+        await self._runner.cleanup()
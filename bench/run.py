@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from dotenv import dotenv_values
+
+from bench.fake_api import FakeBotAPI
+from bench.seed import seed
+from bot import create_bot, create_dispatcher
+from database.engine import create_engine
+from metrics import metrics
+
+
+update_ids = itertools.count(1)
+message_ids = itertools.count(1)
+# friend requests need users without any relations yet
+newcomer_ids = itertools.count(10 ** 9)
+
+
+def message_update(user_id, text=None, **fields):
+    message = {
+        'message_id': next(message_ids),
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False,
+                 'first_name': 'User {}'.format(user_id)},
+        **fields
+    }
+    if text is not None:
+        message['text'] = text
+    return {'update_id': next(update_ids), 'message': message}
+
+
+def add_wish(user_id, rng):
+    steps = ['Добавить в Вишлист', 'Wish {}'.format(rng.randint(1, 10 ** 6)),
+             str(rng.randint(100, 100000)), 'Не добавлять', 'Без фото',
+             'Не присылать', 'Да']
+    return [message_update(user_id, text) for text in steps]
+
+
+def view_wishlist(user_id, rng):
+    return [message_update(user_id, 'Посмотреть Вишлист')]
+
+
+def friend_request(user_id, rng):
+    requester, friend = next(newcomer_ids), next(newcomer_ids)
+    return [
+        message_update(requester, '/start'),
+        message_update(friend, '/start'),
+        message_update(requester, 'Добавить в друзья'),
+        message_update(requester, contact={
+            'phone_number': '0', 'first_name': 'Friend', 'user_id': friend
+        }),
+        message_update(friend, 'Принять'),
+        message_update(friend, '1'),
+    ]
+
+
+def friend_wishlist(user_id, rng):
+    return [
+        message_update(user_id, 'Посмотреть вишлист друга'),
+        message_update(user_id, '1'),
+        message_update(user_id, 'Посмотреть конкретное желание'),
+        message_update(user_id, '1'),
+    ]
+
+
+# settings of .env that change what is measured; the rest (Redis, metrics,
+# webhook, the real token) belongs to the production bot
+TUNING = ('DB_POOL_', 'DB_MAX_OVERFLOW', 'USER_CACHE_', 'WISHLIST_CACHE_',
+          'SEND_', 'SLOW_QUERY_')
+
+
+FLOWS = {
+    'add_wish': add_wish,
+    'view_wishlist': view_wishlist,
+    'friend_request': friend_request,
+    'friend_wishlist': friend_wishlist,
+}
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        if name not in FLOWS:
+            raise argparse.ArgumentTypeError("Unknown flow: {}".format(name))
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = max(int(round(percent / 100 * len(values))) - 1, 0)
+    return values[index]
+
+
+async def virtual_user(dp, bot, user_id, args, latencies, errors):
+    rng = random.Random(user_id)
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+
+    for _ in range(args.iterations):
+        name = rng.choices(names, weights)[0]
+        for update in FLOWS[name](user_id, rng):
+            started = time.perf_counter()
+            try:
+                await dp.feed_raw_update(bot, update)
+            except Exception:
+                logging.exception("Update failed in %s", name)
+                errors[name] += 1
+            latencies[name].append(time.perf_counter() - started)
+
+
+def report(latencies, errors, elapsed, queries, api):
+    updates = sum(len(values) for values in latencies.values())
+    lines = ["{:<16} {:>8} {:>7} {:>9} {:>9}".format(
+        'flow', 'updates', 'errors', 'p50 ms', 'p99 ms'
+    )]
+    everything = []
+    for name, values in sorted(latencies.items()):
+        everything += values
+        lines.append("{:<16} {:>8} {:>7} {:>9.2f} {:>9.2f}".format(
+            name, len(values), errors[name],
+            percentile(values, 50) * 1000, percentile(values, 99) * 1000
+        ))
+    lines.append("{:<16} {:>8} {:>7} {:>9.2f} {:>9.2f}".format(
+        'all', updates, sum(errors.values()),
+        percentile(everything, 50) * 1000, percentile(everything, 99) * 1000
+    ))
+    lines.append("")
+    lines.append("{:.1f} updates/s, {:.2f} queries/update, {:.2f} API calls/update"
+                 .format(updates / elapsed, queries / updates,
+                         sum(api.values()) / updates))
+    lines.append("API calls: " + ", ".join(
+        "{} {}".format(method, count) for method, count in api.most_common()
+    ))
+    return "\n".join(lines)
+
+
+async def run(args):
+    api = FakeBotAPI(latency=args.api_latency / 1000)
+    await api.start()
+
+    config = {key: value for key, value in dotenv_values('.env').items()
+              if key.startswith(TUNING)}
+    config.update(
+        BOT_TOKEN='42:BENCH',
+        DATABASE_URL=args.database_url,
+        TELEGRAM_API_URL=api.base_url,
+        FSM_STORAGE='memory',
+    )
+    if not args.rate_limits:
+        # the fake API has no limits, measure the bot itself
+        config.update(SEND_GLOBAL_RATE='-1', SEND_CHAT_RATE='-1')
+    engine = create_engine(config)
+    await seed(engine, args.users, args.wishes, args.friends, reset=args.reset)
+
+    bot = create_bot(config)
+    dp = create_dispatcher(config, engine)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+
+    latencies, errors = defaultdict(list), defaultdict(int)
+    user_ids = random.Random(0).sample(
+        range(1, args.users + 1), min(args.concurrency, args.users)
+    )
+    queries = metrics.queries
+    api.calls.clear()
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            virtual_user(dp, bot, user_id, args, latencies, errors)
+            for user_id in user_ids
+        ))
+        elapsed = time.perf_counter() - started
+    finally:
+        # the dispatcher closes its storage on shutdown
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+        await engine.dispose()
+        await api.stop()
+
+    result = report(latencies, errors, elapsed, metrics.queries - queries,
+                    api.calls)
+    print(result)
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+            'elapsed': elapsed,
+            'flows': {
+                name: {
+                    'updates': len(values),
+                    'errors': errors[name],
+                    'p50': percentile(values, 50),
+                    'p99': percentile(values, 99),
+                }
+                for name, values in latencies.items()
+            },
+            'api_calls': dict(api.calls),
+        }, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay typical user flows against a fake Bot API"
+    )
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--wishes', type=int, default=20,
+                        help="wishes per seeded user")
+    parser.add_argument('--friends', type=int, default=10,
+                        help="friends of every seeded user")
+    parser.add_argument('--concurrency', type=int, default=50,
+                        help="users sending updates at the same time")
+    parser.add_argument('--iterations', type=int, default=20,
+                        help="flows each concurrent user goes through")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(
+        'add_wish=1,view_wishlist=4,friend_request=1,friend_wishlist=4'
+    ), help="flow=weight,... out of " + ", ".join(FLOWS))
+    parser.add_argument('--api-latency', type=float, default=0,
+                        help="milliseconds the fake Bot API takes per call")
+    parser.add_argument('--rate-limits', action='store_true',
+                        help="pace outgoing messages as for real Telegram")
+    parser.add_argument('--database-url',
+                        help="a throwaway database, a temporary SQLite file "
+                             "by default")
+    parser.add_argument('--reset', action='store_true',
+                        help="drop the tables of --database-url first")
+    parser.add_argument('--output', help="also write the results as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    directory = None
+    if args.database_url is None:
+        directory = tempfile.mkdtemp(prefix='wishlist-bench-')
+        args.database_url = 'sqlite:///{}/bench.sqlite3'.format(directory)
+    try:
+        asyncio.run(run(args))
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import random
+
+from sqlalchemy import insert, select
+
+from database.migrate import create_schema
+from database.models import Base, User, Wishlist, friendship
+
+
+async def seed(engine, users: int, wishes: int, friends: int, reset=False):
+    async with engine.begin() as conn:
+        if reset:
+            await conn.run_sync(Base.metadata.drop_all)
+        try:
+            await create_schema(conn, Base.metadata)
+        except RuntimeError:
+            raise RuntimeError(
+                "The benchmark database is not empty, pass --reset "
+                "to drop it"
+            ) from None
+
+        # Telegram ids 1..users, bot_user ids are whatever the database gives
+        await conn.execute(insert(User), [
+            dict(user_id=user_id, name='User {}'.format(user_id))
+            for user_id in range(1, users + 1)
+        ])
+        ids = (await conn.scalars(
+            select(User.id).order_by(User.user_id)
+        )).all()
+
+        rng = random.Random(users)
+        await conn.execute(insert(Wishlist), [
+            dict(
+                user_id=owner_id,
+                name='Wish {}'.format(number),
+                price=rng.choice([None, rng.randint(100, 100000)]),
+                description=rng.choice([None, 'Description {}'.format(number)]),
+                url=rng.choice([None, 'https://example.com/{}'.format(number)])
+            )
+            for owner_id in ids
+            for number in range(1, wishes + 1)
+        ])
+
+        # every user is friends with the next `friends` users, both directions
+        edges = set()
+        for index, user_id in enumerate(ids):
+            for step in range(1, min(friends, len(ids) - 1) + 1):
+                friend_id = ids[(index + step) % len(ids)]
+                edges.add((user_id, friend_id))
+                edges.add((friend_id, user_id))
+        if edges:
+            await conn.execute(insert(friendship), [
+                dict(friend_a_id=a, friend_b_id=b) for a, b in sorted(edges)
+            ])
@@ -0,0 +1,57 @@
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from handlers import friends, search, wishlist
+from database.cache import user_cache, wishlist_cache
+from database.engine import create_session_pool
+from middlewares.db import DbSessionMiddleware
+from middlewares.metrics import MetricsMiddleware
+from middlewares.throttling import SendScheduler
+from metrics import MetricsServer, instrument_engine
+from storage import create_storage, create_isolation
+
+
+def create_bot(config):
+    session = None
+    if config.get('TELEGRAM_API_URL'):
+        # local Bot API server or a fake one in tests
+        session = AiohttpSession(
+            api=TelegramAPIServer.from_base(config['TELEGRAM_API_URL'])
+        )
+    bot = Bot(token=config['BOT_TOKEN'], session=session, parse_mode="HTML")
+    bot.session.middleware(SendScheduler(
+        global_rate=float(config.get('SEND_GLOBAL_RATE') or 30),
+        chat_rate=float(config.get('SEND_CHAT_RATE') or 1),
+        chat_burst=float(config.get('SEND_CHAT_BURST') or 3),
+        max_retries=int(config.get('SEND_MAX_RETRIES') or 3)
+    ))
+    return bot
+
+
+def create_dispatcher(config, engine):
+    user_cache.configure(
+        maxsize=int(config.get('USER_CACHE_SIZE') or 10000),
+        ttl=int(config.get('USER_CACHE_TTL') or 300)
+    )
+    wishlist_cache.configure(
+        maxsize=int(config.get('WISHLIST_CACHE_SIZE') or 10000),
+        ttl=int(config.get('WISHLIST_CACHE_TTL') or 60)
+    )
+    storage = create_storage(config)
+    dp = Dispatcher(storage=storage, events_isolation=create_isolation(storage))
+    dp.update.outer_middleware(DbSessionMiddleware(create_session_pool(engine)))
+    dp.include_routers(wishlist.router, friends.router, search.router)
+
+    instrument_engine(engine, config)
+    for name, observer in dp.observers.items():
+        if name not in ('update', 'error'):
+            observer.middleware(MetricsMiddleware())
+
+    if config.get('METRICS_PORT'):
+        server = MetricsServer(
+            config.get('METRICS_HOST') or '127.0.0.1',
+            int(config['METRICS_PORT'])
+        )
+        dp.startup.register(server.start)
+        dp.shutdown.register(server.stop)
+    return dp
@@ -1,11 +1,20 @@
-from sqlalchemy import create_engine
+import asyncio
 from dotenv import dotenv_values
-from models import Base
+from database.engine import create_engine
+from database.migrate import create_schema
+from database.models import Base
 
 
-config = dotenv_values('../.env')
+config = dotenv_values('.env')
 
-database_url = config['DATABASE_URL']
-engine = create_engine(database_url, echo=True, pool_recycle=7200)
 
-Base.metadata.create_all(engine)
+async def init_db():
+    engine = create_engine(config)
+    try:
+        async with engine.begin() as conn:
+            await create_schema(conn, Base.metadata)
+    finally:
+        await engine.dispose()
+
+
+asyncio.run(init_db())
@@ -0,0 +1,19 @@
+import asyncio
+import logging
+from dotenv import dotenv_values
+from database.engine import create_engine
+from database.migrate import apply_migrations
+
+
+config = dotenv_values('.env')
+
+
+async def migrate():
+    engine = create_engine(config)
+    async with engine.begin() as conn:
+        await apply_migrations(conn)
+    await engine.dispose()
+
+
+logging.basicConfig(level=logging.INFO)
+asyncio.run(migrate())
@@ -0,0 +1,55 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_database_url(database_url):
+    # old .env files hold a sync URL (postgresql://...), swap the driver
+    url = make_url(database_url)
+    drivername = ASYNC_DRIVERS.get(url.drivername, url.drivername)
+    return url.set(drivername=drivername)
+
+
+def contains_casefold(text, part):
+    if text is None or part is None:
+        return None
+    return part.casefold() in text.casefold()
+
+
+def register_sqlite_functions(dbapi_connection, connection_record):
+    # LIKE in SQLite ignores the case of ASCII letters only
+    dbapi_connection.create_function(
+        'contains_casefold', 2, contains_casefold, deterministic=True
+    )
+
+
+def create_engine(config):
+    database_url = async_database_url(config['DATABASE_URL'])
+    pool_options = {}
+
+    if database_url.get_backend_name() != 'sqlite':
+        pool_options = dict(
+            pool_size=int(config.get('DB_POOL_SIZE') or 5),
+            max_overflow=int(config.get('DB_MAX_OVERFLOW') or 10),
+            pool_timeout=float(config.get('DB_POOL_TIMEOUT') or 30),
+            pool_recycle=int(config.get('DB_POOL_RECYCLE') or 7200),
+            pool_pre_ping=True,
+        )
+
+    engine = create_async_engine(
+        database_url, echo=config.get('DB_ECHO') == 'true', **pool_options
+    )
+    if database_url.get_backend_name() == 'sqlite':
+        event.listen(engine.sync_engine, 'connect', register_sqlite_functions)
+    return engine
+
+
+def create_session_pool(engine):
+    return async_sessionmaker(engine, expire_on_commit=False)
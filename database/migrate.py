@@ -0,0 +1,81 @@
+import logging
+from pathlib import Path
+from sqlalchemy import inspect, text
+
+
+MIGRATIONS_DIR = Path(__file__).parent / 'migrations'
+
+
+def migration_files():
+    return sorted(MIGRATIONS_DIR.glob('*.sql'))
+
+
+def migration_dialect(path):
+    # 0007_name.postgresql.sql only runs on PostgreSQL
+    suffixes = path.suffixes
+    if len(suffixes) > 1:
+        return suffixes[-2].lstrip('.')
+    return None
+
+
+async def ensure_migrations_table(conn):
+    await conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations "
+        "(name VARCHAR(128) PRIMARY KEY)"
+    ))
+
+
+async def applied_migrations(conn):
+    await ensure_migrations_table(conn)
+    result = await conn.execute(text("SELECT name FROM schema_migrations"))
+    return set(result.scalars())
+
+
+async def mark_applied(conn, name):
+    await conn.execute(
+        text("INSERT INTO schema_migrations (name) VALUES (:name)"),
+        dict(name=name)
+    )
+
+
+async def stamp_migrations(conn):
+    # a schema fresh from create_all() already matches the models
+    applied = await applied_migrations(conn)
+    for path in migration_files():
+        if path.name not in applied:
+            await mark_applied(conn, path.name)
+
+
+async def create_schema(conn, metadata):
+    # create_all() skips tables that already exist, stamping those would
+    # hide the migrations they still need
+    exists = await conn.run_sync(
+        lambda sync_conn: inspect(sync_conn).has_table('bot_user')
+    )
+    if exists:
+        raise RuntimeError(
+            "The database already has tables, "
+            "apply the migrations with python -m database._migrate"
+        )
+
+    await conn.run_sync(metadata.create_all)
+    await stamp_migrations(conn)
+
+
+async def apply_migrations(conn):
+    applied = await applied_migrations(conn)
+    for path in migration_files():
+        if path.name in applied:
+            continue
+
+        dialect = migration_dialect(path)
+        if dialect is not None and dialect != conn.dialect.name:
+            await mark_applied(conn, path.name)
+            logging.info("Skipped %s on %s", path.name, conn.dialect.name)
+            continue
+
+        for statement in path.read_text(encoding='utf-8').split(';'):
+            if statement.strip():
+                await conn.execute(text(statement))
+        await mark_applied(conn, path.name)
+        logging.info("Applied %s", path.name)
@@ -0,0 +1,31 @@
+-- Telegram ids do not fit into INTEGER
+ALTER TABLE bot_user ALTER COLUMN user_id TYPE BIGINT;
+
+-- Concurrent /start presses could register one Telegram user twice.
+-- Keep the oldest row and move everything that references the others to it.
+CREATE TEMPORARY TABLE bot_user_duplicates AS
+SELECT id, min(id) OVER (PARTITION BY user_id) AS keep_id
+FROM bot_user;
+
+DELETE FROM bot_user_duplicates WHERE id = keep_id;
+
+UPDATE wishlist SET user_id = d.keep_id
+FROM bot_user_duplicates d WHERE wishlist.user_id = d.id;
+
+UPDATE friendship SET friend_a_id = d.keep_id
+FROM bot_user_duplicates d WHERE friendship.friend_a_id = d.id;
+
+UPDATE friendship SET friend_b_id = d.keep_id
+FROM bot_user_duplicates d WHERE friendship.friend_b_id = d.id;
+
+UPDATE user_requests SET user_inc_req_id = d.keep_id
+FROM bot_user_duplicates d WHERE user_requests.user_inc_req_id = d.id;
+
+UPDATE user_requests SET requester_id = d.keep_id
+FROM bot_user_duplicates d WHERE user_requests.requester_id = d.id;
+
+DELETE FROM bot_user USING bot_user_duplicates d WHERE bot_user.id = d.id;
+
+DROP TABLE bot_user_duplicates;
+
+CREATE UNIQUE INDEX IF NOT EXISTS ix_bot_user_user_id ON bot_user (user_id);
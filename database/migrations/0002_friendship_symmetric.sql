@@ -0,0 +1,17 @@
+-- Store every friendship in both directions and drop duplicate rows
+CREATE TEMPORARY TABLE friendship_pairs AS
+SELECT friend_a_id, friend_b_id FROM friendship
+UNION
+SELECT friend_b_id, friend_a_id FROM friendship;
+
+DELETE FROM friendship;
+
+INSERT INTO friendship (friend_a_id, friend_b_id)
+SELECT friend_a_id, friend_b_id FROM friendship_pairs
+WHERE friend_a_id IS NOT NULL
+  AND friend_b_id IS NOT NULL
+  AND friend_a_id <> friend_b_id;
+
+DROP TABLE friendship_pairs;
+
+ALTER TABLE friendship ADD PRIMARY KEY (friend_a_id, friend_b_id);
@@ -0,0 +1,24 @@
+-- Drop duplicate and stale friend requests before adding the primary key
+CREATE TEMPORARY TABLE user_requests_unique AS
+SELECT DISTINCT user_inc_req_id, requester_id FROM user_requests
+WHERE user_inc_req_id IS NOT NULL
+  AND requester_id IS NOT NULL
+  AND user_inc_req_id <> requester_id;
+
+DELETE FROM user_requests_unique r USING friendship f
+WHERE f.friend_a_id = r.user_inc_req_id AND f.friend_b_id = r.requester_id;
+
+DELETE FROM user_requests;
+
+INSERT INTO user_requests (user_inc_req_id, requester_id)
+SELECT user_inc_req_id, requester_id FROM user_requests_unique;
+
+DROP TABLE user_requests_unique;
+
+ALTER TABLE user_requests ADD PRIMARY KEY (user_inc_req_id, requester_id);
+
+CREATE INDEX IF NOT EXISTS ix_user_requests_requester_id
+ON user_requests (requester_id, user_inc_req_id);
+
+CREATE INDEX IF NOT EXISTS ix_friendship_friend_b_id
+ON friendship (friend_b_id, friend_a_id);
@@ -0,0 +1,4 @@
+-- Wishes are always listed per owner in id order, nothing filters by name
+DROP INDEX IF EXISTS ix_wishlist_name;
+
+CREATE INDEX IF NOT EXISTS ix_wishlist_user_id_id ON wishlist (user_id, id);
@@ -0,0 +1,11 @@
+-- distinct images of wishes, shared by file_unique_id
+CREATE TABLE photo (
+    file_unique_id VARCHAR(64) NOT NULL PRIMARY KEY,
+    file_id VARCHAR(256) NOT NULL,
+    kind VARCHAR(16) NOT NULL,
+    width INTEGER,
+    height INTEGER
+);
+
+ALTER TABLE wishlist
+    ADD COLUMN photo_unique_id VARCHAR(64) REFERENCES photo (file_unique_id);
@@ -0,0 +1,7 @@
+-- more than one photo per wish, sent as an album
+CREATE TABLE wish_photo (
+    wish_id INTEGER NOT NULL REFERENCES wishlist (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    photo_unique_id VARCHAR(64) NOT NULL REFERENCES photo (file_unique_id),
+    PRIMARY KEY (wish_id, position)
+);
@@ -0,0 +1,6 @@
+-- Inline search matches a part of the name with ILIKE, a trigram index
+-- answers it without reading every wish
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS ix_wishlist_name_trgm
+    ON wishlist USING gin (name gin_trgm_ops);
@@ -1,24 +1,67 @@
+import enum
 from typing import List, Optional
-from sqlalchemy import String, ForeignKey, Table, Column, Integer
+from sqlalchemy import String, ForeignKey, Table, Column, Integer,\
+    BigInteger, Index, DDL, event, select, insert, delete, exists, func,\
+    or_, and_
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column,\
-    relationship, backref
+    relationship, make_transient_to_detached, joinedload
+
+from database.cache import user_cache
 
 
 class Base(DeclarativeBase):
     pass
 
 
+# gin_trgm_ops of the wish name index comes from this extension
+event.listen(Base.metadata, 'before_create', DDL(
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+).execute_if(dialect='postgresql'))
+
+
+class Relation(enum.Enum):
+    NONE = 'none'
+    FRIEND = 'friend'
+    OUTGOING = 'outgoing'
+    INCOMING = 'incoming'
+
+
+def dialect_insert(session, table):
+    # ON CONFLICT is dialect specific, SQLite is used for local runs
+    if session.get_bind().dialect.name == 'sqlite':
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+
 friendship = Table(
     'friendship', Base.metadata,
-    Column('friend_a_id', Integer, ForeignKey('bot_user.id')),
-    Column('friend_b_id', Integer, ForeignKey('bot_user.id'))
+    Column('friend_a_id', Integer, ForeignKey('bot_user.id'),
+           primary_key=True),
+    Column('friend_b_id', Integer, ForeignKey('bot_user.id'),
+           primary_key=True),
+    Index('ix_friendship_friend_b_id', 'friend_b_id', 'friend_a_id')
 )
 
 
 user_requests = Table(
     'user_requests', Base.metadata,
-    Column('user_inc_req_id', Integer, ForeignKey('bot_user.id')),
-    Column('requester_id', Integer, ForeignKey('bot_user.id'))
+    Column('user_inc_req_id', Integer, ForeignKey('bot_user.id'),
+           primary_key=True),
+    Column('requester_id', Integer, ForeignKey('bot_user.id'),
+           primary_key=True),
+    Index('ix_user_requests_requester_id', 'requester_id', 'user_inc_req_id')
+)
+
+
+# Photos of a wish after the first one, which is Wishlist.photo_unique_id
+wish_photo = Table(
+    'wish_photo', Base.metadata,
+    Column('wish_id', Integer, ForeignKey('wishlist.id', ondelete='CASCADE'),
+           primary_key=True),
+    Column('position', Integer, primary_key=True),
+    Column('photo_unique_id', String(64), ForeignKey('photo.file_unique_id'),
+           nullable=False)
 )
 
 
@@ -27,91 +70,294 @@ class User(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(128))
-    user_id: Mapped[int] = mapped_column()
+    user_id: Mapped[int] = mapped_column(BigInteger, unique=True, index=True)
     wishlists: Mapped[List["Wishlist"]] = relationship(
-        back_populates="user", cascade="all, delete-orphan"
-    )
-    friends = relationship(
-        'User', secondary=friendship,
-        primaryjoin=(friendship.c.friend_a_id == id),
-        secondaryjoin=(friendship.c.friend_b_id == id),
-        backref=backref('friendship', lazy='dynamic'), lazy='dynamic'
-    )
-    requests = relationship(
-        'User', secondary=user_requests,
-        primaryjoin=(user_requests.c.user_inc_req_id == id),
-        secondaryjoin=(user_requests.c.requester_id == id),
-        backref=backref('user_requests', lazy='dynamic'), lazy='dynamic'
+        back_populates="user", cascade="all, delete-orphan",
+        order_by="Wishlist.id"
     )
 
-    def get_incoming_requests(self, session):
-        incoming_requests = session.query(User).join(
-            user_requests, user_requests.c.requester_id == User.id
-        ).filter(
-            user_requests.c.user_inc_req_id == self.id
-        ).all()
-        return incoming_requests
-
-    def get_friends(self, session):
-        friends = session.query(User).join(
-            friendship, friendship.c.friend_a_id == User.id
-        ).filter(
-            friendship.c.friend_b_id == self.id
-        ).all()
-        if len(friends) > 0:
-            return friends
-        else:
-            friends = session.query(User).join(
+    @classmethod
+    async def register(cls, session, user_id, name):
+        upsert = dialect_insert(session, cls).values(
+            user_id=user_id, name=name
+        )
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[cls.user_id],
+            set_=dict(name=upsert.excluded.name),
+            where=cls.name != upsert.excluded.name
+        )
+        await session.execute(upsert)
+        user_cache.invalidate(user_id)
+
+    @classmethod
+    async def get_by_user_id(cls, session, user_id):
+        cached = user_cache.get(user_id)
+        if cached is not None:
+            id, name = cached
+            user = cls(id=id, user_id=user_id, name=name)
+            make_transient_to_detached(user)
+            return user
+
+        user = await session.scalar(
+            select(cls).filter_by(user_id=user_id)
+        )
+        if user is not None:
+            user_cache.set(user_id, (user.id, user.name))
+        return user
+
+    async def get_incoming_requests(self, session):
+        incoming_requests = await session.scalars(
+            select(User).join(
+                user_requests, user_requests.c.requester_id == User.id
+            ).where(
+                user_requests.c.user_inc_req_id == self.id
+            ).order_by(user_requests.c.requester_id)
+        )
+        return incoming_requests.all()
+
+    # Friendship is stored in both directions, (a, b) and (b, a),
+    # so every friend lookup is a range scan on the primary key. Lists are
+    # numbered for the user, they come in primary key order
+    async def get_friends(self, session):
+        friends = await session.scalars(
+            select(User).join(
                 friendship, friendship.c.friend_b_id == User.id
-            ).filter(
+            ).where(
                 friendship.c.friend_a_id == self.id
-            ).all()
-            return friends
-
-    def cancel_friend_request(self, user):
-        if not self.is_friend(user) and self.is_request(user):
-            self.friends.remove(user)
-            user.friends.remove(self)
-
-    def is_friend(self, user):
-        return self.friends.filter(
-            friendship.c.friend_b_id == user.id
-        ).count() > 0
-
-    def is_request(self, user):
-        return self.requests.filter(
-            user_requests.c.requester_id == user.id
-        ).count() > 0
-
-    def send_friend_request(self, user):
-        if not user.is_friend(self) and not user.is_request(self) and not self.is_request(user):
-            user.requests.append(self)
+            ).order_by(friendship.c.friend_b_id)
+        )
+        return friends.all()
+
+    async def get_friend(self, session, friend_id):
+        return await session.scalar(
+            select(User).join(
+                friendship, friendship.c.friend_b_id == User.id
+            ).where(
+                friendship.c.friend_a_id == self.id,
+                friendship.c.friend_b_id == friend_id
+            )
+        )
+
+    async def get_incoming_request(self, session, requester_id):
+        return await session.scalar(
+            select(User).join(
+                user_requests, user_requests.c.requester_id == User.id
+            ).where(
+                user_requests.c.user_inc_req_id == self.id,
+                user_requests.c.requester_id == requester_id
+            )
+        )
+
+    async def is_friend(self, session, friend_id):
+        return await session.scalar(
+            select(exists().where(
+                friendship.c.friend_a_id == self.id,
+                friendship.c.friend_b_id == friend_id
+            ))
+        )
+
+    async def get_relation(self, session, user):
+        is_friend, is_outgoing, is_incoming = (await session.execute(
+            select(
+                exists().where(
+                    friendship.c.friend_a_id == self.id,
+                    friendship.c.friend_b_id == user.id
+                ),
+                exists().where(
+                    user_requests.c.user_inc_req_id == user.id,
+                    user_requests.c.requester_id == self.id
+                ),
+                exists().where(
+                    user_requests.c.user_inc_req_id == self.id,
+                    user_requests.c.requester_id == user.id
+                )
+            )
+        )).one()
+
+        if is_friend:
+            return Relation.FRIEND
+        if is_outgoing:
+            return Relation.OUTGOING
+        if is_incoming:
+            return Relation.INCOMING
+        return Relation.NONE
+
+    async def send_friend_request(self, session, user):
+        if self.id != user.id \
+                and await self.get_relation(session, user) is Relation.NONE:
+            await session.execute(
+                dialect_insert(session, user_requests).values(
+                    user_inc_req_id=user.id, requester_id=self.id
+                ).on_conflict_do_nothing()
+            )
             return self
 
-    def delete_friend(self, user):
-        if self.is_friend(user):
-            self.friends.remove(user)
-            user.friends.remove(self)
+    async def delete_friend(self, session, user):
+        await session.execute(
+            delete(friendship).where(or_(
+                and_(friendship.c.friend_a_id == self.id,
+                     friendship.c.friend_b_id == user.id),
+                and_(friendship.c.friend_a_id == user.id,
+                     friendship.c.friend_b_id == self.id)
+            ))
+        )
 
-    def can_accept_request(self, user):
-        if not user.is_friend(self) and self.is_request(user):
-            return True
-        else:
+    async def accept_friend_request(self, session, user):
+        request = await session.execute(
+            delete(user_requests).where(
+                user_requests.c.user_inc_req_id == self.id,
+                user_requests.c.requester_id == user.id
+            ).returning(user_requests.c.requester_id)
+        )
+        if request.first() is None:
             return False
 
+        await session.execute(
+            dialect_insert(session, friendship).values([
+                dict(friend_a_id=self.id, friend_b_id=user.id),
+                dict(friend_a_id=user.id, friend_b_id=self.id)
+            ]).on_conflict_do_nothing()
+        )
+        return True
+
+    async def decline_friend_request(self, session, user):
+        request = await session.execute(
+            delete(user_requests).where(
+                user_requests.c.user_inc_req_id == self.id,
+                user_requests.c.requester_id == user.id
+            ).returning(user_requests.c.requester_id)
+        )
+        return request.first() is not None
+
 
 class Wishlist(Base):
     __tablename__ = "wishlist"
+    __table_args__ = (
+        Index('ix_wishlist_user_id_id', 'user_id', 'id'),
+        Index('ix_wishlist_name_trgm', 'name', postgresql_using='gin',
+              postgresql_ops={'name': 'gin_trgm_ops'})
+        .ddl_if(dialect='postgresql'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    name: Mapped[str] = mapped_column(String(256), index=True)
+    name: Mapped[str] = mapped_column(String(256))
     price: Mapped[Optional[int]]
+    # photo_id is the file_id of wishes added before the photo table
     photo_id: Mapped[Optional[str]]
+    photo_unique_id: Mapped[Optional[str]] = mapped_column(
+        ForeignKey("photo.file_unique_id")
+    )
     url: Mapped[Optional[str]]
     description: Mapped[Optional[str]]
     user_id: Mapped[int] = mapped_column(ForeignKey("bot_user.id"))
 
     user: Mapped["User"] = relationship(back_populates="wishlists")
+    photo: Mapped[Optional["Photo"]] = relationship()
+    extra_photos: Mapped[List["Photo"]] = relationship(
+        secondary=wish_photo, order_by=wish_photo.c.position, viewonly=True
+    )
+
+    # An index-only scan of (user_id, id), the numbering of a wishlist
+    @classmethod
+    async def get_ids(cls, session, owner_id):
+        wish_ids = await session.scalars(
+            select(cls.id).filter_by(user_id=owner_id).order_by(cls.id)
+        )
+        return wish_ids.all()
+
+    # One page of a wishlist, primary key lookups however far it is
+    @classmethod
+    async def get_by_ids(cls, session, owner_id, wish_ids):
+        wishes = await session.scalars(
+            select(cls).filter_by(user_id=owner_id)
+            .where(cls.id.in_(wish_ids)).order_by(cls.id)
+        )
+        return wishes.all()
+
+    # Own and friends' wishes with a part of the name, newest first.
+    # PostgreSQL answers ILIKE from the trigram index, SQLite only folds
+    # the case of ASCII letters and gets a Python function instead
+    @classmethod
+    async def search(cls, session, user_id, text, limit, cursor=None):
+        friends = select(friendship.c.friend_b_id)\
+            .where(friendship.c.friend_a_id == user_id)
+        query = select(cls).where(
+            or_(cls.user_id == user_id, cls.user_id.in_(friends))
+        ).options(joinedload(cls.user), joinedload(cls.photo))
+
+        if text:
+            if session.get_bind().dialect.name == 'sqlite':
+                query = query.where(func.contains_casefold(cls.name, text))
+            else:
+                query = query.where(cls.name.icontains(text, autoescape=True))
+        if cursor is not None:
+            query = query.where(cls.id < cursor)
+
+        wishes = (await session.scalars(
+            query.order_by(cls.id.desc()).limit(limit + 1)
+        )).all()
+        return list(wishes[:limit]), len(wishes) > limit
+
+    @classmethod
+    async def get_owned(cls, session, owner_id, wish_id):
+        wishes = await session.scalars(
+            select(cls).filter_by(id=wish_id, user_id=owner_id)
+            .options(joinedload(cls.photo), joinedload(cls.extra_photos))
+        )
+        return wishes.unique().first()
+
+    async def add_extra_photos(self, session, photo_unique_ids):
+        if photo_unique_ids:
+            await session.execute(insert(wish_photo), [
+                dict(wish_id=self.id, position=position, photo_unique_id=uid)
+                for position, uid in enumerate(photo_unique_ids, 1)
+            ])
+
+    @classmethod
+    async def delete_owned(cls, session, owner_id, wish_id):
+        deleted = await session.execute(
+            delete(cls).where(cls.id == wish_id, cls.user_id == owner_id)
+            .returning(cls.id)
+            .execution_options(synchronize_session=False)
+        )
+        if deleted.first() is None:
+            return False
+
+        # SQLite does not enforce ON DELETE CASCADE without a pragma
+        await session.execute(
+            delete(wish_photo).where(wish_photo.c.wish_id == wish_id)
+        )
+        return True
 
     def __repr__(self) -> str:
         return "Wishlist(id={!r}, name={!r})".format(self.id, self.name)
+
+
+# One row per distinct image, wishes with the same picture share it
+class Photo(Base):
+    __tablename__ = "photo"
+
+    file_unique_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    file_id: Mapped[str] = mapped_column(String(256))
+    kind: Mapped[str] = mapped_column(String(16))
+    width: Mapped[Optional[int]]
+    height: Mapped[Optional[int]]
+
+    @classmethod
+    async def store(cls, session, file_unique_id, file_id, kind,
+                    width=None, height=None):
+        # file_id may change between uploads, keep the latest one
+        upsert = dialect_insert(session, cls.__table__).values(
+            file_unique_id=file_unique_id, file_id=file_id, kind=kind,
+            width=width, height=height
+        )
+        await session.execute(upsert.on_conflict_do_update(
+            index_elements=[cls.file_unique_id],
+            set_=dict(file_id=upsert.excluded.file_id)
+        ))
+        return file_unique_id
+
+    def __repr__(self) -> str:
+        return "Photo(file_unique_id={!r}, kind={!r})".format(
+            self.file_unique_id, self.kind
+        )
@@ -1,26 +1,47 @@
-from aiogram import Router, types, F
+from aiogram import Router, F
 from aiogram.filters import StateFilter
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
-from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
-from dotenv import dotenv_values
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from states import AddFriend
+from states import AddFriend, pack_wish_refs, pick_wish_ref,\
+    unpack_wish_refs, pack_user_refs, pick_user_ref
 from keyboard import friend_kb, menu_kb, make_row_keyboard, make_num_keyboard
-from database.models import User
+from database.models import User, Wishlist
+from handlers.wishlist import wishlist_snapshot, wishlist_page,\
+    add_wishlist_page, answer_wish_card
 from texts import texts
+from reply import Reply
 
 
-config = dotenv_values('.env')
-database_url = config['DATABASE_URL']
+router = Router()
 
-engine = create_engine(database_url, echo=True, pool_recycle=7200)
-session = Session(engine)
 
-router = Router()
+def render_users(title, users):
+    users_text = "".join(
+        "{}) {} | {}\n".format(index, user.name, user.user_id)
+        for index, user in enumerate(users, 1)
+    )
+    return texts["check_req_list"].format(title, '-' * 50, users_text)
+
+
+# The number refers to the list shown with the prompt, the friendship
+# or request may be gone since then
+async def pick_friend(session, state, user, number):
+    friend_id = pick_user_ref((await state.get_data()).get('friends'), number)
+    if friend_id is None:
+        return None
+    return await user.get_friend(session, friend_id)
+
+
+async def pick_request(session, state, user, number):
+    requester_id = pick_user_ref(
+        (await state.get_data()).get('requests'), number
+    )
+    if requester_id is None:
+        return None
+    return await user.get_incoming_request(session, requester_id)
 
 
 @router.message(F.text.lower() == "друзья")
@@ -32,11 +53,9 @@ async def friends_reply(message: Message):
 
 
 @router.message(F.text.lower() == "посмотреть друзей")
-async def check_friends(message: Message):
-    user = session.query(User).filter_by(
-        user_id=message.from_user.id).first()
-
-    friends = user.get_friends(session)
+async def check_friends(message: Message, session: AsyncSession):
+    user = await User.get_by_user_id(session, message.from_user.id)
+    friends = await user.get_friends(session)
 
     if len(friends) == 0:
         await message.answer(
@@ -44,14 +63,8 @@ async def check_friends(message: Message):
         )
 
     else:
-        friend_text = ""
-        for index, friend in enumerate(friends):
-            friend_text += "{}) {} | {}\n".format(
-                index + 1, friend.name, friend.user_id)
-
         await message.answer(
-            texts["check_req_list"]
-            .format("Друзья", '-' * 50, friend_text),
+            render_users("Друзья", friends),
             reply_markup=make_row_keyboard([
                 'Посмотреть Вишлист друга', 'Удалить', 'Отменить'
             ])
@@ -66,12 +79,11 @@ async def check_friends(message: Message):
 )
 async def delete_friend_reply(
         message: Message,
-        state: FSMContext
+        state: FSMContext,
+        session: AsyncSession
 ):
-    user = session.query(User).filter_by(
-        user_id=message.from_user.id).first()
-
-    friends = user.get_friends(session)
+    user = await User.get_by_user_id(session, message.from_user.id)
+    friends = await user.get_friends(session)
 
     if len(friends) == 0:
         await message.answer(
@@ -79,11 +91,13 @@ async def delete_friend_reply(
         )
 
     else:
-        await check_requests(message)
-        await message.answer(
-            texts["delete_friend"],
-            reply_markup=make_num_keyboard(friends)
+        await state.update_data(
+            friends=pack_user_refs(friend.id for friend in friends)
         )
+        reply = Reply(message)
+        reply.add(render_users("Друзья", friends))
+        reply.add(texts["delete_friend"], make_num_keyboard(friends))
+        await reply.send()
         await state.set_state(AddFriend.deleting_friend)
 
 
@@ -91,19 +105,19 @@ async def delete_friend_reply(
     AddFriend.deleting_friend,
     F.text.regexp(r"^\d+$").as_("digits")
 )
-async def delete_friend(message: Message, state: FSMContext):
+async def delete_friend(
+        message: Message,
+        state: FSMContext,
+        session: AsyncSession
+):
     id = int(message.text)
 
-    user = session.query(User).filter_by(
-        user_id=message.from_user.id).first()
-
-    friends = user.get_friends(session)
-    friend = friends[id - 1]
+    user = await User.get_by_user_id(session, message.from_user.id)
+    friend = await pick_friend(session, state, user, id)
 
     if friend is not None:
-        user.friends.remove(friend)
-        session.add(user)
-        session.commit()
+        await user.delete_friend(session, friend)
+        await session.commit()
         await message.answer(
             "{} удален из друзей!".format(friend.name),
             reply_markup=friend_kb
@@ -134,17 +148,16 @@ async def add_friend(message: Message, state: FSMContext):
     AddFriend.sending_contact,
     F.contact
 )
-async def send_request(message: Message, state: FSMContext):
+async def send_request(
+        message: Message,
+        state: FSMContext,
+        session: AsyncSession
+):
     user_id = message.from_user.id
     contact_user_id = message.contact.user_id
 
-    user = session.query(User).filter_by(
-        user_id=user_id).first()
-
-    contact_user = session.query(User).filter_by(
-        user_id=contact_user_id).first()
-
-    request = user.send_friend_request(contact_user)
+    user = await User.get_by_user_id(session, user_id)
+    contact_user = await User.get_by_user_id(session, contact_user_id)
 
     if contact_user is None:
         await message.answer(
@@ -152,6 +165,11 @@ async def send_request(message: Message, state: FSMContext):
             "не зарегистрировался",
             reply_markup=friend_kb
         )
+        await state.clear()
+        return
+
+    request = await user.send_friend_request(session, contact_user)
+    await session.commit()
 
     if request is None:
         await message.answer(
@@ -162,8 +180,6 @@ async def send_request(message: Message, state: FSMContext):
         await state.clear()
 
     else:
-        session.add(request)
-        session.commit()
         await message.answer(
             text="Запрос отправлен!",
             reply_markup=friend_kb
@@ -174,13 +190,11 @@ async def send_request(message: Message, state: FSMContext):
 @router.message(
     F.text.lower() == "посмотреть входящие заявки"
 )
-async def check_requests(message: Message):
+async def check_requests(message: Message, session: AsyncSession):
     user_id = message.from_user.id
-    user = session.query(User).filter_by(
-        user_id=user_id).first()
 
-    incoming_requests = user.get_incoming_requests(
-        session=session)
+    user = await User.get_by_user_id(session, user_id)
+    incoming_requests = await user.get_incoming_requests(session)
 
     if len(incoming_requests) == 0:
         await message.answer(
@@ -188,14 +202,8 @@ async def check_requests(message: Message):
         )
 
     else:
-        req_text = ""
-        for index, req_user in enumerate(incoming_requests):
-            req_text += "{}) {} | {}\n".format(
-                index + 1, req_user.name, req_user.user_id)
-
         await message.answer(
-            texts["check_req_list"]
-            .format("Входящие заявки", '-' * 50, req_text),
+            render_users("Входящие заявки", incoming_requests),
             reply_markup=make_row_keyboard(['Принять', 'Отклонить', 'Отменить'])
         )
 
@@ -206,19 +214,28 @@ async def check_requests(message: Message):
 )
 async def accept_request_reply(
         message: Message,
-        state: FSMContext
+        state: FSMContext,
+        session: AsyncSession
 ):
-    user = session.query(User).filter_by(
-        user_id=message.from_user.id).first()
-
-    incoming_requests = user.get_incoming_requests(
-        session=session)
+    user = await User.get_by_user_id(session, message.from_user.id)
+    incoming_requests = await user.get_incoming_requests(session)
 
-    await check_requests(message)
-    await message.answer(
+    if len(incoming_requests) == 0:
+        await message.answer(
+            "Заявок нет!"
+        )
+        return
+
+    await state.update_data(requests=pack_user_refs(
+        request_user.id for request_user in incoming_requests
+    ))
+    reply = Reply(message)
+    reply.add(render_users("Входящие заявки", incoming_requests))
+    reply.add(
         texts["processing_request"].format("принять"),
-        reply_markup=make_num_keyboard(incoming_requests)
+        make_num_keyboard(incoming_requests)
     )
+    await reply.send()
     await state.set_state(AddFriend.accepting_request)
 
 
@@ -228,19 +245,28 @@ async def accept_request_reply(
 )
 async def cancel_request_reply(
         message: Message,
-        state: FSMContext
+        state: FSMContext,
+        session: AsyncSession
 ):
-    user = session.query(User).filter_by(
-        user_id=message.from_user.id).first()
-
-    incoming_requests = user.get_incoming_requests(
-        session=session)
+    user = await User.get_by_user_id(session, message.from_user.id)
+    incoming_requests = await user.get_incoming_requests(session)
 
-    await check_requests(message)
-    await message.answer(
+    if len(incoming_requests) == 0:
+        await message.answer(
+            "Заявок нет!"
+        )
+        return
+
+    await state.update_data(requests=pack_user_refs(
+        request_user.id for request_user in incoming_requests
+    ))
+    reply = Reply(message)
+    reply.add(render_users("Входящие заявки", incoming_requests))
+    reply.add(
         texts["processing_request"].format("отклонить"),
-        reply_markup=make_num_keyboard(incoming_requests)
+        make_num_keyboard(incoming_requests)
     )
+    await reply.send()
     await state.set_state(AddFriend.deleting_request)
 
 
@@ -248,21 +274,19 @@ async def cancel_request_reply(
     AddFriend.accepting_request,
     F.text.regexp(r"^\d+$").as_("digits")
 )
-async def accept_friend_request(message: Message, state: FSMContext):
+async def accept_friend_request(
+        message: Message,
+        state: FSMContext,
+        session: AsyncSession
+):
     id = int(message.text)
 
-    user = session.query(User).filter_by(
-        user_id=message.from_user.id).first()
+    user = await User.get_by_user_id(session, message.from_user.id)
+    request_user = await pick_request(session, state, user, id)
 
-    incoming_requests = user.get_incoming_requests(
-        session=session)
-    request_user = incoming_requests[id - 1]
-
-    if request_user is not None and user.can_accept_request(request_user):
-        user.friends.append(request_user)
-        user.requests.remove(request_user)
-        session.add(user)
-        session.commit()
+    if request_user is not None \
+            and await user.accept_friend_request(session, request_user):
+        await session.commit()
 
         await message.answer(
             "Заявка принята!",
@@ -282,21 +306,19 @@ async def accept_friend_request(message: Message, state: FSMContext):
     AddFriend.deleting_request,
     F.text.regexp(r"^\d+$").as_("digits")
 )
-async def cancel_friend_request(message: Message, state: FSMContext):
+async def cancel_friend_request(
+        message: Message,
+        state: FSMContext,
+        session: AsyncSession
+):
     id = int(message.text)
 
-    user = session.query(User).filter_by(
-        user_id=message.from_user.id).first()
+    user = await User.get_by_user_id(session, message.from_user.id)
+    request_user = await pick_request(session, state, user, id)
 
-    incoming_requests = user.get_incoming_requests(
-        session=session)
-    request_user = incoming_requests[id - 1]
-
-    if request_user is not None and user.can_accept_request(request_user):
-        user.friends.append(request_user)
-        user.requests.remove(request_user)
-        session.add(user)
-        session.commit()
+    if request_user is not None \
+            and await user.decline_friend_request(session, request_user):
+        await session.commit()
 
         await message.answer(
             "Заявка отклонена!",
@@ -316,11 +338,13 @@ async def cancel_friend_request(message: Message, state: FSMContext):
     StateFilter(None),
     F.text.lower() == 'посмотреть вишлист друга'
 )
-async def check_friend(message: Message, state: FSMContext):
-    user = session.query(User).filter_by(
-        user_id=message.from_user.id).first()
-
-    friends = user.get_friends(session)
+async def check_friend(
+        message: Message,
+        state: FSMContext,
+        session: AsyncSession
+):
+    user = await User.get_by_user_id(session, message.from_user.id)
+    friends = await user.get_friends(session)
 
     if len(friends) == 0:
         await message.answer(
@@ -328,12 +352,17 @@ async def check_friend(message: Message, state: FSMContext):
         )
 
     else:
-        await check_friends(message)
-        await message.answer(
+        await state.update_data(
+            friends=pack_user_refs(friend.id for friend in friends)
+        )
+        reply = Reply(message)
+        reply.add(render_users("Друзья", friends))
+        reply.add(
             "Выберите номер друга, "
             "<b>Вишлист</b> которого хотите посмотреть",
-            reply_markup=make_num_keyboard(friends)
+            make_num_keyboard(friends)
         )
+        await reply.send()
         await state.set_state(AddFriend.viewing_wishlist)
 
 
@@ -341,21 +370,24 @@ async def check_friend(message: Message, state: FSMContext):
     AddFriend.viewing_wishlist,
     F.text.regexp(r"^\d+$").as_("digits")
 )
-async def check_friend_wishlist(message: Message, state: FSMContext):
+async def check_friend_wishlist(
+        message: Message,
+        state: FSMContext,
+        session: AsyncSession
+):
     id = int(message.text)
 
-    user = session.query(User).filter_by(
-        user_id=message.from_user.id).first()
-
-    friends = user.get_friends(session)
-    friend = friends[id - 1]
+    user = await User.get_by_user_id(session, message.from_user.id)
+    friend = await pick_friend(session, state, user, id)
 
     if friend is not None:
-        friend_wishlist = friend.wishlists
-
-        await state.update_data(friend_wishlist=friend_wishlist)
+        snapshot = await wishlist_snapshot(session, friend.id)
+        wish_ids = snapshot.wish_ids
+        await state.update_data(
+            friend_wishlist=pack_wish_refs(friend.id, wish_ids)
+        )
 
-        if len(friend.wishlists) == 0:
+        if len(wish_ids) == 0:
             await message.answer(
                 "У друга еще нет Вишлиста!",
                 reply_markup=menu_kb
@@ -364,21 +396,12 @@ async def check_friend_wishlist(message: Message, state: FSMContext):
             return
 
         else:
-            wishlist_text = ""
-            for index, wish in enumerate(friend_wishlist):
-                if wish.price is None:
-                    wishlist_text += "{}) {} |  \n".format(index + 1, wish.name)
-
-                else:
-                    wishlist_text += "{}) {} | {}\n".format(index + 1, wish.name, wish.price)
-
-            await message.answer(
-                texts['view_friend_wl'].format('-' * 50, wishlist_text),
-                reply_markup=make_row_keyboard([
-                    'Посмотреть конкретное желание',
-                    'Меню'
-                ])
+            wishlist_text, page_kb = await wishlist_page(
+                session, snapshot, 'view_friend_wl'
             )
+            reply = Reply(message)
+            add_wishlist_page(reply, wishlist_text, page_kb)
+            await reply.send()
             await state.set_state(AddFriend.choosing_item)
 
     else:
@@ -398,11 +421,11 @@ async def check_item_friend_wl_reply(
     state: FSMContext
 ):
     wish_data = await state.get_data()
-    wishlist = wish_data['friend_wishlist']
+    _, wish_ids = unpack_wish_refs(wish_data.get('friend_wishlist'))
 
     await message.answer(
         texts["check_item_wl_reply"],
-        reply_markup=make_num_keyboard(wishlist)
+        reply_markup=make_num_keyboard(wish_ids)
     )
     await state.set_state(AddFriend.viewing_item_wl)
 
@@ -411,65 +434,26 @@ async def check_item_friend_wl_reply(
     AddFriend.viewing_item_wl,
     F.text.regexp(r"^\d+$").as_("digits")
 )
-async def check_item_friend_wl(message: Message, state: FSMContext):
+async def check_item_friend_wl(
+        message: Message,
+        state: FSMContext,
+        session: AsyncSession
+):
     id = int(message.text)
 
     wish_data = await state.get_data()
-    wishlist = wish_data['friend_wishlist']
-    wish = wishlist[id - 1]
-
-    name = wish.name
-    price = wish.price
-    description = wish.description
-    photo = wish.photo_id
-    url = wish.url
-
-    wish_info = "Название: {}\n".format(name)
+    owner_id, wish_id = pick_wish_ref(wish_data.get('friend_wishlist'), id)
+    wish = await Wishlist.get_owned(session, owner_id, wish_id)
 
-    inline_builder = InlineKeyboardBuilder()
-
-    if price is not None:
-        wish_info += "Цена: {}\n\n".format(str(price))
-
-    if description is not None:
-        wish_info += "Описание: {}\n".format(description)
-
-    if photo is not None:
-
-        if url is not None:
-            inline_builder.row(
-                types.InlineKeyboardButton(text='Ссылка', url=url))
-            await message.answer_photo(
-                photo,
-                caption=wish_info,
-                reply_markup=inline_builder.as_markup()
-            )
-            await state.clear()
-
-        else:
-            await message.answer_photo(
-                photo,
-                caption=wish_info,
-                reply_markup=menu_kb
-            )
-            await state.clear()
-
-    else:
-        if url is not None:
-            inline_builder.row(
-                types.InlineKeyboardButton(text='Ссылка', url=url))
-            await message.answer(
-                wish_info,
-                reply_markup=inline_builder.as_markup(),
-            )
-            await state.clear()
+    if wish is None:
+        await message.answer(
+            "Желания под таким номером "
+            "не существует!"
+        )
+        return
 
-        else:
-            await message.answer(
-                wish_info,
-                reply_markup=menu_kb
-            )
-            await state.clear()
+    await answer_wish_card(message, wish)
+    await state.clear()
 
 
 @router.message(
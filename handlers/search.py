@@ -0,0 +1,73 @@
+from aiogram import Router
+from aiogram.types import InlineQuery, InlineQueryResultArticle,\
+    InlineQueryResultCachedPhoto, InlineQueryResultCachedDocument,\
+    InlineQueryResultsButton, InputTextMessageContent
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import User, Wishlist
+from handlers.wishlist import wish_card_text, link_keyboard
+from media import wish_cover
+
+
+router = Router()
+
+SEARCH_PAGE_SIZE = 20
+# results depend on the caller's friends, so Telegram caches them per user
+SEARCH_CACHE_TIME = 30
+
+
+def wish_result(wish, user):
+    title = wish.name if wish.user_id == user.id \
+        else "{} ({})".format(wish.name, wish.user.name)
+    description = "" if wish.price is None else "Цена: {}".format(wish.price)
+    text = wish_card_text(wish)
+    reply_markup = link_keyboard(wish.url) if wish.url is not None else None
+
+    # a result can't carry an album, it shows the first photo
+    cover = wish_cover(wish)
+    if cover is not None:
+        file_id, kind = cover
+        if kind == 'document':
+            return InlineQueryResultCachedDocument(
+                id=str(wish.id), title=title, document_file_id=file_id,
+                description=description, caption=text,
+                reply_markup=reply_markup
+            )
+        return InlineQueryResultCachedPhoto(
+            id=str(wish.id), title=title, photo_file_id=file_id,
+            description=description, caption=text, reply_markup=reply_markup
+        )
+
+    return InlineQueryResultArticle(
+        id=str(wish.id), title=title, description=description,
+        input_message_content=InputTextMessageContent(message_text=text),
+        reply_markup=reply_markup
+    )
+
+
+@router.inline_query()
+async def search_wishes(inline_query: InlineQuery, session: AsyncSession):
+    user = await User.get_by_user_id(session, inline_query.from_user.id)
+
+    if user is None:
+        await inline_query.answer(
+            [], cache_time=SEARCH_CACHE_TIME, is_personal=True,
+            button=InlineQueryResultsButton(
+                text="Зарегистрироваться в боте", start_parameter='inline'
+            )
+        )
+        return
+
+    # the offset is the id of the last wish already shown
+    cursor = int(inline_query.offset) if inline_query.offset.isdigit() \
+        else None
+    wishes, has_more = await Wishlist.search(
+        session, user.id, inline_query.query.strip(), SEARCH_PAGE_SIZE, cursor
+    )
+
+    await inline_query.answer(
+        [wish_result(wish, user) for wish in wishes],
+        cache_time=SEARCH_CACHE_TIME, is_personal=True,
+        next_offset=str(wishes[-1].id) if has_more else ""
+    )
@@ -1,40 +1,168 @@
+from bisect import bisect_left, bisect_right
+
 from aiogram import Router, types, F, html
 from aiogram.filters import Command, StateFilter
-from aiogram.types import Message
+from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
-from dotenv import dotenv_values
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from states import AddWish, DelWish, CheckWish
-from keyboard import wishlist_kb, menu_kb, make_row_keyboard, make_num_keyboard
-from database.models import User, Wishlist
+from states import AddWish, DelWish, CheckWish, pack_wish_refs,\
+    pick_wish_ref
+from keyboard import wishlist_kb, menu_kb, make_row_keyboard,\
+    make_num_keyboard, make_page_keyboard, WishlistPage
+from database.models import User, Wishlist, Photo
+from database.cache import wishlist_cache
 from texts import texts
+from reply import Reply
+from media import pick_photo, wish_media, answer_media, answer_album,\
+    add_to_album
+
 
+router = Router()
 
-config = dotenv_values('.env')
-database_url = config['DATABASE_URL']
+PAGE_SIZE = 10
 
-engine = create_engine(database_url, echo=True, pool_recycle=7200)
-session = Session(engine)
 
-router = Router()
+def render_wishes(wishes, numbers):
+    return "".join(
+        "{}) {} | {}\n".format(
+            numbers[wish.id], wish.name,
+            " " if wish.price is None else wish.price
+        )
+        for wish in wishes
+    )
+
+
+# A cached wishlist is one read of the owner's wish ids with the pages
+# rendered from it, so the numbers a user is shown and the numbers the
+# pickers resolve can't disagree, even when another process has changed
+# the wishlist since
+class WishlistSnapshot:
+    def __init__(self, owner_id, wish_ids):
+        self.owner_id = owner_id
+        self.wish_ids = tuple(wish_ids)
+        # (cursor, backward) -> (rendered page, keyboard)
+        self.pages = {}
+
+
+async def wishlist_snapshot(session: AsyncSession, owner_id: int):
+    snapshot = wishlist_cache.get(owner_id)
+    if snapshot is None:
+        snapshot = WishlistSnapshot(
+            owner_id, await Wishlist.get_ids(session, owner_id)
+        )
+        wishlist_cache.set(owner_id, snapshot)
+    return snapshot
+
+
+async def wishlist_page(
+        session: AsyncSession,
+        snapshot: WishlistSnapshot,
+        header: str,
+        cursor: int = 0,
+        backward: bool = False
+):
+    page_key = (cursor, backward)
+    page = snapshot.pages.get(page_key)
+    if page is None:
+        page = snapshot.pages[page_key] = await render_wishlist_page(
+            session, snapshot, cursor, backward
+        )
+
+    wishlist_text, page_kb = page
+    if wishlist_text is None:
+        return None, None
+
+    return texts[header].format('-' * 50, wishlist_text), page_kb
+
+
+async def render_wishlist_page(
+        session: AsyncSession,
+        snapshot: WishlistSnapshot,
+        cursor: int,
+        backward: bool
+):
+    # keyset over the snapshot: the page after or before the cursor id
+    wish_ids = snapshot.wish_ids
+    if backward:
+        end = bisect_left(wish_ids, cursor)
+        begin = max(end - PAGE_SIZE, 0)
+    else:
+        begin = bisect_right(wish_ids, cursor)
+        end = min(begin + PAGE_SIZE, len(wish_ids))
+
+    page_ids = wish_ids[begin:end]
+    if len(page_ids) == 0:
+        return None, None
+
+    wishes = await Wishlist.get_by_ids(session, snapshot.owner_id, page_ids)
+    numbers = {
+        wish_id: number for number, wish_id in enumerate(page_ids, begin + 1)
+    }
+    return (
+        render_wishes(wishes, numbers),
+        make_page_keyboard(
+            snapshot.owner_id, page_ids, begin > 0, end < len(wish_ids)
+        )
+    )
+
+
+def wish_card_text(wish: Wishlist):
+    wish_info = "Название: {}\n".format(wish.name)
+
+    if wish.price is not None:
+        wish_info += "Цена: {}\n\n".format(str(wish.price))
+
+    if wish.description is not None:
+        wish_info += "Описание: {}\n".format(wish.description)
+
+    return wish_info
+
+
+def link_keyboard(url):
+    inline_builder = InlineKeyboardBuilder()
+    inline_builder.row(types.InlineKeyboardButton(text='Ссылка', url=url))
+    return inline_builder.as_markup()
+
+
+async def answer_wish_card(message: Message, wish: Wishlist):
+    wish_info = wish_card_text(wish)
+
+    if wish.url is not None:
+        reply_markup = link_keyboard(wish.url)
+
+    else:
+        reply_markup = menu_kb
+
+    media = wish_media(wish)
+    if len(media) > 1:
+        # an album takes no buttons, the link goes into the caption
+        if wish.url is not None:
+            wish_info += '<a href="{}">Ссылка</a>'.format(html.quote(wish.url))
+        await answer_album(message, media, wish_info)
+
+    elif media:
+        file_id, kind = media[0]
+        await answer_media(
+            message, file_id, kind,
+            caption=wish_info,
+            reply_markup=reply_markup
+        )
+
+    else:
+        await message.answer(wish_info, reply_markup=reply_markup)
 
 
 @router.message(Command('start'))
-async def start_handler(message: Message):
+async def start_handler(message: Message, session: AsyncSession):
 
     user_fullname = html.quote(message.from_user.full_name)
     user_id = message.from_user.id
-    user = session.query(User).filter_by(
-        user_id=user_id).first()
 
-    if user is None:
-        user = User(name=user_fullname, user_id=user_id)
-        session.add(user)
-        session.commit()
+    await User.register(session, user_id, user_fullname)
+    await session.commit()
 
     await message.answer(
         texts['greet'].format(username=user_fullname),
@@ -55,9 +183,12 @@ async def wishlist_reply(message: Message):
         "добавить в вишлист", "создать вишлист"
     }
 ))
-async def add_to_wishlist_reply(message: Message, state: FSMContext):
-    user = session.query(User).filter_by(
-        user_id=message.from_user.id).first()
+async def add_to_wishlist_reply(
+        message: Message,
+        state: FSMContext,
+        session: AsyncSession
+):
+    user = await User.get_by_user_id(session, message.from_user.id)
 
     if user is None:
         await message.answer(
@@ -142,7 +273,7 @@ async def wish_description_written(message: Message, state: FSMContext):
     F.text.lower() == "без фото"
 )
 async def wish_photo_not_sent(message: Message, state: FSMContext):
-    await state.update_data(photo_id=None)
+    await state.update_data(photos=[])
     await message.answer(
         texts["add_link"],
         reply_markup=make_row_keyboard(["Не присылать", "Отменить"])
@@ -152,9 +283,15 @@ async def wish_photo_not_sent(message: Message, state: FSMContext):
 
 @router.message(AddWish.sending_wish_photo)
 async def wish_photo_sent(message: Message, state: FSMContext):
-    photo_id = message.photo[0].file_id
+    photo = pick_photo(message)
 
-    await state.update_data(photo_id=photo_id)
+    if photo is None:
+        await message.answer(texts['photo_error'])
+        return
+
+    await state.update_data(
+        photos=[photo], media_group_id=message.media_group_id
+    )
     await message.answer(
         texts["add_link"],
         reply_markup=make_row_keyboard(["Не присылать", "Отменить"])
@@ -175,6 +312,18 @@ async def wish_url_not_sent(message: Message, state: FSMContext):
     await state.set_state(AddWish.database)
 
 
+@router.message(AddWish.sending_wish_url, F.media_group_id)
+async def wish_album_photo_sent(message: Message, state: FSMContext):
+    # the rest of an album whose first photo moved the wizard on
+    wish_data = await state.get_data()
+    if message.media_group_id != wish_data.get('media_group_id'):
+        return
+
+    photos = wish_data['photos']
+    if add_to_album(photos, pick_photo(message)):
+        await state.update_data(photos=photos)
+
+
 @router.message(AddWish.sending_wish_url)
 async def wish_url_sent(message: Message, state: FSMContext):
     await state.update_data(url=message.text)
@@ -189,23 +338,32 @@ async def wish_url_sent(message: Message, state: FSMContext):
     F.text.lower() == "да",
     AddWish.database
 )
-async def add_to_database(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-    user = session.query(User).filter_by(
-        user_id=message.from_user.id).first()
-
+async def add_to_database(
+        message: Message,
+        state: FSMContext,
+        session: AsyncSession
+):
     wish_data = await state.get_data()
+
+    user = await User.get_by_user_id(session, message.from_user.id)
+
+    photo_unique_ids = [
+        await Photo.store(session, **photo) for photo in wish_data['photos']
+    ]
+
     wish = Wishlist(
         name=wish_data['name'],
         price=wish_data['price'],
         description=wish_data['description'],
-        photo_id=wish_data['photo_id'],
+        photo_unique_id=photo_unique_ids[0] if photo_unique_ids else None,
         url=wish_data['url'],
-        user_id=user_id)
+        user_id=user.id)
 
-    user.wishlists.append(wish)
-    session.add(user)
-    session.commit()
+    session.add(wish)
+    await session.flush()
+    await wish.add_extra_photos(session, photo_unique_ids[1:])
+    await session.commit()
+    wishlist_cache.invalidate(user.id)
 
     await message.answer(
         "Успешно добавлено!",
@@ -214,37 +372,72 @@ async def add_to_database(message: Message, state: FSMContext):
     await state.clear()
 
 
-@router.message(
-    F.text.lower() == "посмотреть вишлист"
-)
-async def view_wishlist(message: Message):
-    user = session.query(User).filter_by(
-        user_id=message.from_user.id).first()
+def add_wishlist_page(reply: Reply, wishlist_text, page_kb):
+    actions_kb = make_row_keyboard(["Посмотреть конкретное желание", "Меню"])
 
-    wishlist_text = ""
-    wishlist = user.wishlists
+    if page_kb is None:
+        reply.add(wishlist_text, actions_kb)
 
-    if len(user.wishlists) == 0:
-        await message.answer(
+    else:
+        reply.add(wishlist_text, page_kb)
+        reply.add(texts['wl_actions'], actions_kb, filler=True)
+
+
+async def add_wishlist(reply: Reply, session: AsyncSession, snapshot):
+    wishlist_text, page_kb = await wishlist_page(session, snapshot, 'view_wl')
+
+    if wishlist_text is None:
+        reply.add(
             texts['create_wl'],
-            reply_markup=make_row_keyboard(
-                ["Создать Вишлист", "Отменить"])
+            make_row_keyboard(["Создать Вишлист", "Отменить"])
         )
 
     else:
-        for index, wish in enumerate(wishlist):
-            if wish.price is None:
-                wishlist_text += "{}) {} |  \n".format(index + 1, wish.name)
+        add_wishlist_page(reply, wishlist_text, page_kb)
 
-            else:
-                wishlist_text += "{}) {} | {}\n".format(index + 1, wish.name, wish.price)
 
-        await message.answer(
-            texts['view_wl'].format('-' * 50, wishlist_text),
-            reply_markup=make_row_keyboard(
-                ["Посмотреть конкретное желание", "Меню"]
-            )
-        )
+@router.message(
+    F.text.lower() == "посмотреть вишлист"
+)
+async def view_wishlist(message: Message, session: AsyncSession):
+    user = await User.get_by_user_id(session, message.from_user.id)
+    snapshot = await wishlist_snapshot(session, user.id)
+    reply = Reply(message)
+    await add_wishlist(reply, session, snapshot)
+    await reply.send()
+
+
+@router.callback_query(WishlistPage.filter())
+async def turn_wishlist_page(
+        callback: CallbackQuery,
+        callback_data: WishlistPage,
+        session: AsyncSession
+):
+    user = await User.get_by_user_id(session, callback.from_user.id)
+    owner_id = callback_data.owner_id
+
+    if user is None or owner_id != user.id \
+            and not await user.is_friend(session, owner_id):
+        await callback.answer()
+        return
+
+    header = 'view_wl' if owner_id == user.id else 'view_friend_wl'
+    wishlist_text, page_kb = await wishlist_page(
+        session,
+        await wishlist_snapshot(session, owner_id),
+        header,
+        cursor=callback_data.cursor,
+        backward=callback_data.backward
+    )
+
+    if wishlist_text is None:
+        await callback.answer("Вишлист пуст")
+        return
+
+    await Reply(callback.message).add(wishlist_text, page_kb).send(
+        edit=callback.message.message_id
+    )
+    await callback.answer()
 
 
 @router.message(
@@ -253,17 +446,16 @@ async def view_wishlist(message: Message):
 )
 async def check_item_wl_reply(
     message: Message,
-    state: FSMContext
+    state: FSMContext,
+    session: AsyncSession
 ):
-    user = session.query(User).filter_by(
-        user_id=message.from_user.id).first()
-
-    wishlist = user.wishlists
+    user = await User.get_by_user_id(session, message.from_user.id)
+    wish_ids = (await wishlist_snapshot(session, user.id)).wish_ids
 
-    await state.update_data(wishlist=wishlist)
+    await state.update_data(wishlist=pack_wish_refs(user.id, wish_ids))
     await message.answer(
         texts["check_item_wl_reply"],
-        reply_markup=make_num_keyboard(wishlist)
+        reply_markup=make_num_keyboard(wish_ids)
     )
     await state.set_state(CheckWish.choosing_item_wl)
 
@@ -272,65 +464,26 @@ async def check_item_wl_reply(
     CheckWish.choosing_item_wl,
     F.text.regexp(r"^\d+$").as_("digits")
 )
-async def check_item_wl(message: Message, state: FSMContext):
+async def check_item_wl(
+        message: Message,
+        state: FSMContext,
+        session: AsyncSession
+):
     id = int(message.text)
 
     wish_data = await state.get_data()
-    wishlist = wish_data['wishlist']
-    wish = wishlist[id - 1]
+    owner_id, wish_id = pick_wish_ref(wish_data.get('wishlist'), id)
+    wish = await Wishlist.get_owned(session, owner_id, wish_id)
 
-    name = wish.name
-    price = wish.price
-    description = wish.description
-    photo = wish.photo_id
-    url = wish.url
-
-    wish_info = "Название: {}\n".format(name)
-
-    inline_builder = InlineKeyboardBuilder()
-
-    if price is not None:
-        wish_info += "Цена: {}\n\n".format(str(price))
-
-    if description is not None:
-        wish_info += "Описание: {}\n".format(description)
-
-    if photo is not None:
-
-        if url is not None:
-            inline_builder.row(
-                types.InlineKeyboardButton(text='Ссылка', url=url))
-            await message.answer_photo(
-                photo,
-                caption=wish_info,
-                reply_markup=inline_builder.as_markup()
-            )
-            await state.clear()
-
-        else:
-            await message.answer_photo(
-                photo,
-                caption=wish_info,
-                reply_markup=menu_kb
-            )
-            await state.clear()
+    if wish is None:
+        await message.answer(
+            "Желания под таким номером "
+            "не существует!"
+        )
+        return
 
-    else:
-        if url is not None:
-            inline_builder.row(
-                types.InlineKeyboardButton(text='Ссылка', url=url))
-            await message.answer(
-                wish_info,
-                reply_markup=inline_builder.as_markup(),
-            )
-            await state.clear()
-
-        else:
-            await message.answer(
-                wish_info,
-                reply_markup=menu_kb
-            )
-            await state.clear()
+    await answer_wish_card(message, wish)
+    await state.clear()
 
 
 @router.message(
@@ -339,19 +492,23 @@ async def check_item_wl(message: Message, state: FSMContext):
 )
 async def delete_from_wishlist_reply(
         message: Message,
-        state: FSMContext
+        state: FSMContext,
+        session: AsyncSession
 ):
-    user = session.query(User).filter_by(
-        user_id=message.from_user.id).first()
-
-    wishlist = user.wishlists
+    user = await User.get_by_user_id(session, message.from_user.id)
+    snapshot = await wishlist_snapshot(session, user.id)
+    wish_ids = snapshot.wish_ids
+
+    reply = Reply(message)
+    await add_wishlist(reply, session, snapshot)
+    if len(wish_ids) == 0:
+        await reply.send()
+        return
 
-    await view_wishlist(message)
     await state.set_state(DelWish.deleting_wish)
-    await message.answer(
-        texts['delete_from_wl'],
-        reply_markup=make_num_keyboard(wishlist)
-    )
+    await state.update_data(wishlist=pack_wish_refs(user.id, wish_ids))
+    reply.add(texts['delete_from_wl'], make_num_keyboard(wish_ids))
+    await reply.send()
 
 
 @router.message(
@@ -360,22 +517,22 @@ async def delete_from_wishlist_reply(
 )
 async def delete_from_wishlist(
         message: Message,
-        state: FSMContext
+        state: FSMContext,
+        session: AsyncSession
 ):
     id = int(message.text)
-    user = session.query(User).filter_by(
-        user_id=message.from_user.id).first()
 
-    wish = user.wishlists[id - 1]
-
-    if wish is not None:
-        session.delete(wish)
-        session.commit()
-        await message.answer(
-            "Успешно удалено!",
-            reply_markup=wishlist_kb
+    wish_data = await state.get_data()
+    owner_id, wish_id = pick_wish_ref(wish_data.get('wishlist'), id)
+
+    if await Wishlist.delete_owned(session, owner_id, wish_id):
+        await session.commit()
+        wishlist_cache.invalidate(owner_id)
+        reply = Reply(message).add("Успешно удалено!")
+        await add_wishlist(
+            reply, session, await wishlist_snapshot(session, owner_id)
         )
-        await view_wishlist(message)
+        await reply.send()
         await state.clear()
 
     else:
@@ -1,5 +1,9 @@
+from functools import lru_cache
+from typing import Iterable, Sized, Union
+
+from aiogram.filters.callback_data import CallbackData
 from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
-from aiogram.utils.keyboard import ReplyKeyboardBuilder
+from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 
 menu_buttons = [
     KeyboardButton(text="Вишлист"),
@@ -52,16 +56,50 @@ friend_kb = friends_builder.as_markup(
 )
 
 
-def make_row_keyboard(items: list[str]) -> ReplyKeyboardMarkup:
+# markups are shared between calls, callers must not modify them: most
+# aiogram types are frozen, but markups and buttons are MutableTelegramObject
+@lru_cache(maxsize=None)
+def _row_keyboard(items: tuple[str, ...]) -> ReplyKeyboardMarkup:
     row = [KeyboardButton(text=item) for item in items]
     return ReplyKeyboardMarkup(keyboard=[row], resize_keyboard=True)
 
 
-def make_num_keyboard(items: list[str]):
+def make_row_keyboard(items: Iterable[str]) -> ReplyKeyboardMarkup:
+    return _row_keyboard(tuple(items))
+
+
+@lru_cache(maxsize=256)
+def _num_keyboard(count: int) -> ReplyKeyboardMarkup:
     builder = ReplyKeyboardBuilder()
-    for i, _ in enumerate(items):
+    for i in range(count):
         builder.add(KeyboardButton(text=str(i + 1)))
 
     builder.add(KeyboardButton(text='Отменить'))
     builder.adjust(4)
     return builder.as_markup(resize_keyboard=True)
+
+
+def make_num_keyboard(items: Union[int, Sized]) -> ReplyKeyboardMarkup:
+    return _num_keyboard(items if isinstance(items, int) else len(items))
+
+
+class WishlistPage(CallbackData, prefix='wl'):
+    owner_id: int
+    cursor: int
+    backward: bool
+
+
+def make_page_keyboard(owner_id, page_ids, has_prev, has_next):
+    if not has_prev and not has_next:
+        return None
+
+    builder = InlineKeyboardBuilder()
+    if has_prev:
+        builder.button(text='⬅️', callback_data=WishlistPage(
+            owner_id=owner_id, cursor=page_ids[0], backward=True
+        ))
+    if has_next:
+        builder.button(text='➡️', callback_data=WishlistPage(
+            owner_id=owner_id, cursor=page_ids[-1], backward=False
+        ))
+    return builder.as_markup()
@@ -0,0 +1,76 @@
+from typing import Optional
+
+from aiogram.types import Message, InputMediaPhoto, InputMediaDocument
+
+
+ALBUM_LIMIT = 10
+
+
+def pick_photo(message: Message) -> Optional[dict]:
+    if message.photo:
+        # sizes of one photo, from thumbnail to the original
+        size = max(message.photo, key=lambda size: size.width * size.height)
+        return dict(
+            file_unique_id=size.file_unique_id, file_id=size.file_id,
+            kind='photo', width=size.width, height=size.height
+        )
+
+    document = message.document
+    if document is not None \
+            and (document.mime_type or '').startswith('image/'):
+        # sent as a file, can only be sent back as a file
+        return dict(
+            file_unique_id=document.file_unique_id, file_id=document.file_id,
+            kind='document'
+        )
+
+    return None
+
+
+def wish_media(wish):
+    if wish.photo is not None:
+        return [(photo.file_id, photo.kind)
+                for photo in [wish.photo] + wish.extra_photos]
+    if wish.photo_id is not None:
+        return [(wish.photo_id, 'photo')]
+    return []
+
+
+def wish_cover(wish):
+    # the first photo only, without loading the rest of the album
+    if wish.photo is not None:
+        return wish.photo.file_id, wish.photo.kind
+    if wish.photo_id is not None:
+        return wish.photo_id, 'photo'
+    return None
+
+
+async def answer_media(message: Message, file_id, kind, **kwargs):
+    if kind == 'document':
+        return await message.answer_document(file_id, **kwargs)
+    return await message.answer_photo(file_id, **kwargs)
+
+
+async def answer_album(message: Message, media, caption):
+    # one sendMediaGroup call, the caption goes with the first item
+    input_media = []
+    for file_id, kind in media:
+        input_type = InputMediaDocument if kind == 'document' \
+            else InputMediaPhoto
+        input_media.append(input_type(
+            media=file_id, caption=caption if not input_media else None
+        ))
+    return await message.answer_media_group(input_media)
+
+
+def add_to_album(photos, photo):
+    if photo is None or len(photos) >= ALBUM_LIMIT:
+        return False
+    # an album can't mix photos and files
+    if photo['kind'] != photos[0]['kind']:
+        return False
+    if any(item['file_unique_id'] == photo['file_unique_id']
+           for item in photos):
+        return False
+    photos.append(photo)
+    return True
@@ -0,0 +1,189 @@
+import logging
+import random
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Optional
+
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class QueryStats:
+    __slots__ = ('queries', 'rows')
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+
+
+class HandlerMetrics:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.calls = 0
+        self.seconds = 0.0
+        self.errors = 0
+        self.queries = 0
+        self.rows = 0
+
+
+class Metrics:
+    def __init__(self):
+        self.handlers = defaultdict(HandlerMetrics)
+        self.queries = 0
+        self.rows = 0
+        self.slow_queries = 0
+        # name -> value / name -> function returning {labels: value}
+        self.counters = defaultdict(float)
+        self.gauges = {}
+
+    def observe_handler(self, name, seconds, stats: QueryStats, failed=False):
+        handler = self.handlers[name]
+        handler.calls += 1
+        handler.seconds += seconds
+        handler.queries += stats.queries
+        handler.rows += stats.rows
+        if failed:
+            handler.errors += 1
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                handler.buckets[index] += 1
+
+    def observe_query(self, rows):
+        self.queries += 1
+        self.rows += rows
+
+    def render(self) -> str:
+        lines = ["# TYPE bot_handler_seconds histogram"]
+        for name, handler in sorted(self.handlers.items()):
+            bounds = [str(bound) for bound in BUCKETS] + ['+Inf']
+            for bound, count in zip(bounds, handler.buckets + [handler.calls]):
+                lines.append(
+                    'bot_handler_seconds_bucket{{handler="{}",le="{}"}} {}'
+                    .format(name, bound, count)
+                )
+            lines.append('bot_handler_seconds_sum{{handler="{}"}} {}'
+                         .format(name, handler.seconds))
+            lines.append('bot_handler_seconds_count{{handler="{}"}} {}'
+                         .format(name, handler.calls))
+
+        for metric, attr in (
+                ('bot_handler_errors_total', 'errors'),
+                ('bot_handler_db_queries_total', 'queries'),
+                ('bot_handler_db_rows_total', 'rows')
+        ):
+            lines.append("# TYPE {} counter".format(metric))
+            for name, handler in sorted(self.handlers.items()):
+                lines.append('{}{{handler="{}"}} {}'
+                             .format(metric, name, getattr(handler, attr)))
+
+        for metric, value in (
+                ('bot_db_queries_total', self.queries),
+                ('bot_db_rows_total', self.rows),
+                ('bot_db_slow_queries_total', self.slow_queries)
+        ):
+            lines.append("# TYPE {} counter".format(metric))
+            lines.append("{} {}".format(metric, value))
+
+        for metric, value in sorted(self.counters.items()):
+            lines.append("# TYPE {} counter".format(metric))
+            lines.append("{} {}".format(metric, value))
+
+        for metric, collect in sorted(self.gauges.items()):
+            lines.append("# TYPE {} gauge".format(metric))
+            for labels, value in sorted(collect().items()):
+                lines.append("{}{{{}}} {}".format(metric, labels, value))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+# set by MetricsMiddleware for the handler being run
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar(
+    'current_query_stats', default=None
+)
+
+
+def fetched_rows(cursor):
+    # rowcount is only set for INSERT/UPDATE/DELETE. For a SELECT the async
+    # adapters of asyncpg and aiosqlite buffer the whole result right after
+    # execute, in the private _rows of AsyncAdapt_*_cursor; that is how
+    # SQLAlchemy 2.0 does it (requirements.txt pins ~=2.0.30) and
+    # tests/test_metrics.py fails if an upgrade changes it. Nothing public
+    # tells the size without fetching the rows before the ORM does
+    if cursor.description is not None:
+        return len(getattr(cursor, '_rows', ()))
+    return max(cursor.rowcount, 0)
+
+
+def instrument_engine(engine: AsyncEngine, config):
+    slow_query_seconds = float(config.get('SLOW_QUERY_MS') or 100) / 1000
+    slow_query_sample = float(config.get('SLOW_QUERY_SAMPLE') or 1)
+    # bound parameters are user data: names, links, Telegram ids
+    slow_query_params = config.get('SLOW_QUERY_PARAMS') == 'true'
+    logger = logging.getLogger('database.slow_query')
+
+    @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context,
+                             executemany):
+        seconds = time.perf_counter() - conn.info['query_started'].pop()
+        rows = fetched_rows(cursor)
+
+        metrics.observe_query(rows)
+        stats = current_query_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.rows += rows
+
+        if seconds >= slow_query_seconds:
+            metrics.slow_queries += 1
+            if random.random() < slow_query_sample:
+                if slow_query_params:
+                    logger.warning(
+                        "Slow query (%.1f ms, %d rows): %s %r",
+                        seconds * 1000, rows, statement, parameters
+                    )
+                else:
+                    logger.warning(
+                        "Slow query (%.1f ms, %d rows): %s",
+                        seconds * 1000, rows, statement
+                    )
+
+    @event.listens_for(engine.sync_engine, 'handle_error')
+    def handle_error(context):
+        if context.connection is not None:
+            started = context.connection.info.get('query_started')
+            if started:
+                started.pop()
+
+
+class MetricsServer:
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type='text/plain')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host=self.host, port=self.port).start()
+        logging.info("Metrics on http://%s:%d/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
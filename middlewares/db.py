@@ -0,0 +1,47 @@
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+
+# the session of the update being handled, for code outside the handler
+current_session: ContextVar[Optional[AsyncSession]] = ContextVar(
+    'current_session', default=None
+)
+
+
+async def release_connection():
+    # Handlers commit their writes before answering, so what is left open
+    # when a message goes out is a read transaction. Ending it returns the
+    # connection to the pool while the message waits for its turn, and a
+    # later read simply begins a new one
+    session = current_session.get()
+    if session is not None and session.in_transaction():
+        await session.commit()
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    def __init__(self, session_pool: async_sessionmaker):
+        super().__init__()
+        self.session_pool = session_pool
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with self.session_pool() as session:
+            data['session'] = session
+            token = current_session.set(session)
+            try:
+                result = await handler(event, data)
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+            finally:
+                current_session.reset(token)
+            return result
@@ -0,0 +1,34 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from metrics import metrics, current_query_stats, QueryStats
+
+
+class MetricsMiddleware(BaseMiddleware):
+    # inner middleware: filters have passed and data['handler'] is known
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        # several routers have a handler named cancel
+        callback = data['handler'].callback
+        name = callback.__module__ + '.' + callback.__qualname__
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            current_query_stats.reset(token)
+            metrics.observe_handler(
+                name, time.perf_counter() - started, stats, failed
+            )
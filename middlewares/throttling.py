@@ -0,0 +1,191 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware,\
+    NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+
+from metrics import metrics
+from middlewares.db import release_connection
+
+
+REPLY = 0
+BROADCAST = 1
+
+send_priority: ContextVar[int] = ContextVar('send_priority', default=REPLY)
+
+
+@contextmanager
+def broadcast():
+    # messages nobody is waiting for give way to replies
+    token = send_priority.set(BROADCAST)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        # below one token the bucket would never let anything through
+        if capacity < 1:
+            raise ValueError(
+                "Bucket capacity must be at least 1, got {}".format(capacity)
+            )
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if now > self.updated:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+
+    def wait_time(self) -> float:
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return max(self.updated - time.monotonic(), 0) \
+            + (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        # no tokens until Telegram lets us send again
+        self.tokens = 0
+        self.updated = max(self.updated, time.monotonic() + seconds)
+
+    def is_idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class Limiter:
+    # waiters are released by priority, then in arrival order
+    def __init__(self, rate: float, capacity: float):
+        self.bucket = TokenBucket(rate, capacity)
+        self.waiters = []
+        self._order = itertools.count()
+        self._releasing = None
+
+    async def acquire(self, priority: int = REPLY):
+        if not self.waiters and self.bucket.wait_time() == 0:
+            self.bucket.take()
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self._order), future))
+        if self._releasing is None or self._releasing.done():
+            self._releasing = asyncio.create_task(self._release())
+        await future
+
+    async def _release(self):
+        while self.waiters:
+            delay = self.bucket.wait_time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                self.bucket.take()
+                future.set_result(None)
+
+    def is_idle(self) -> bool:
+        return not self.waiters and self.bucket.is_idle()
+
+
+class SendScheduler(BaseRequestMiddleware):
+    def __init__(
+            self,
+            global_rate: float = 30,
+            chat_rate: float = 1,
+            chat_burst: float = 3,
+            max_retries: int = 3
+    ):
+        self.global_limiter = None
+        if global_rate > 0:
+            # a second's worth of messages, at least one
+            self.global_limiter = Limiter(global_rate, max(global_rate, 1))
+        self.chat_rate = chat_rate
+        self.chat_burst = max(chat_burst, 1)
+        self.max_retries = max_retries
+        self.chats = {}
+        self._sweep_at = 1000
+        metrics.gauges['bot_send_queue_depth'] = self.queue_depth
+
+    def queue_depth(self):
+        depth = {'queue="chat"': sum(
+            len(limiter.waiters) for limiter in self.chats.values()
+        )}
+        if self.global_limiter is not None:
+            depth['queue="global"'] = len(self.global_limiter.waiters)
+        return depth
+
+    def chat_limiter(self, chat_id):
+        limiter = self.chats.get(chat_id)
+        if limiter is None:
+            if len(self.chats) >= self._sweep_at:
+                # an idle limiter is as good as a new one
+                for key in [key for key, value in self.chats.items()
+                            if value.is_idle()]:
+                    del self.chats[key]
+                self._sweep_at = max(1000, len(self.chats) * 2)
+            limiter = self.chats[chat_id] = Limiter(
+                self.chat_rate, self.chat_burst
+            )
+        return limiter
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType,
+            bot: Bot,
+            method: TelegramMethod
+    ):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            # getUpdates, answerCallbackQuery and the like are not limited
+            return await make_request(bot, method)
+
+        # the wait below, and any flood wait, must not hold a connection
+        await release_connection()
+
+        priority = send_priority.get()
+        chat_limiter = self.chat_limiter(chat_id) if self.chat_rate > 0 \
+            else None
+
+        for attempt in itertools.count():
+            started = time.monotonic()
+            if chat_limiter is not None:
+                await chat_limiter.acquire(priority)
+            if self.global_limiter is not None:
+                await self.global_limiter.acquire(priority)
+            metrics.counters['bot_send_wait_seconds_total'] += \
+                time.monotonic() - started
+
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                logging.warning(
+                    "Flood wait %ss for chat %s, retrying %s",
+                    e.retry_after, chat_id, type(method).__name__
+                )
+                metrics.counters['bot_send_retries_total'] += 1
+                if chat_limiter is not None:
+                    chat_limiter.bucket.pause(e.retry_after)
+                else:
+                    await asyncio.sleep(e.retry_after)
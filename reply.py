@@ -0,0 +1,77 @@
+from typing import List, Optional
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, InlineKeyboardMarkup
+
+
+TEXT_LIMIT = 4096
+
+
+class Reply:
+    # Collects the messages a handler answers with and sends them as few
+    # messages as possible: adjacent texts are joined while the keyboards
+    # allow it and the result fits into one message
+    def __init__(self, message: Message):
+        self.bot = message.bot
+        self.chat_id = message.chat.id
+        self.parts = []
+
+    def add(self, text: str, reply_markup=None, filler: bool = False):
+        # a filler text only carries a reply keyboard and is dropped
+        # when a later part brings its own one
+        self.parts.append((text, reply_markup, filler))
+        return self
+
+    def compose(self):
+        parts = []
+        for index, (text, markup, filler) in enumerate(self.parts):
+            if filler and any(
+                    later_markup is not None
+                    and not isinstance(later_markup, InlineKeyboardMarkup)
+                    for _, later_markup, _ in self.parts[index + 1:]
+            ):
+                continue
+
+            if parts and can_merge(parts[-1], (text, markup)):
+                previous_text, previous_markup = parts.pop()
+                text = previous_text + "\n\n" + text
+                markup = markup if markup is not None else previous_markup
+            parts.append((text, markup))
+        return parts
+
+    async def send(self, edit: Optional[int] = None) -> List[Message]:
+        # edit is a message of ours the first part without a reply keyboard
+        # replaces, if Telegram still allows editing it
+        sent = []
+        for text, markup in self.compose():
+            if edit is not None \
+                    and (markup is None or isinstance(markup, InlineKeyboardMarkup)):
+                message_id, edit = edit, None
+                try:
+                    sent.append(await self.bot.edit_message_text(
+                        text, chat_id=self.chat_id, message_id=message_id,
+                        reply_markup=markup
+                    ))
+                    continue
+                except TelegramBadRequest as e:
+                    if 'message is not modified' in e.message:
+                        continue
+
+            sent.append(await self.bot.send_message(
+                self.chat_id, text, reply_markup=markup
+            ))
+        return sent
+
+
+def can_merge(previous, following):
+    previous_text, previous_markup = previous
+    text, markup = following
+
+    if len(previous_text) + 2 + len(text) > TEXT_LIMIT:
+        return False
+    # inline buttons belong to their message, a reply keyboard to the chat
+    if isinstance(previous_markup, InlineKeyboardMarkup):
+        return False
+    if isinstance(markup, InlineKeyboardMarkup):
+        return previous_markup is None
+    return True
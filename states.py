@@ -27,3 +27,38 @@ class AddFriend(StatesGroup):
     choosing_item = State()
     viewing_wishlist = State()
     viewing_item_wl = State()
+
+
+# FSM data keeps only (version, owner id, wish ids) for a shown wishlist,
+# bump the version when the layout changes
+WISH_REFS_VERSION = 1
+
+
+def pack_wish_refs(owner_id, wish_ids):
+    return WISH_REFS_VERSION, owner_id, tuple(wish_ids)
+
+
+def unpack_wish_refs(wish_refs):
+    if not wish_refs or wish_refs[0] != WISH_REFS_VERSION:
+        return None, ()
+    _, owner_id, wish_ids = wish_refs
+    return owner_id, tuple(wish_ids)
+
+
+def pick_wish_ref(wish_refs, number):
+    owner_id, wish_ids = unpack_wish_refs(wish_refs)
+    if 1 <= number <= len(wish_ids):
+        return owner_id, wish_ids[number - 1]
+    return owner_id, None
+
+
+# Friends and requests are picked by their number in the list shown last,
+# FSM data keeps the bot_user ids of that list
+def pack_user_refs(user_ids):
+    return tuple(user_ids)
+
+
+def pick_user_ref(user_refs, number):
+    if user_refs and 1 <= number <= len(user_refs):
+        return user_refs[number - 1]
+    return None
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, BaseEventIsolation,\
+    StorageKey, StateType
+from aiogram.fsm.storage.memory import MemoryStorage, SimpleEventIsolation
+
+
+# Local stand-in for Redis: one process, records expire after ttl seconds
+class SQLiteStorage(BaseStorage):
+    def __init__(self, path: str = 'fsm.sqlite3', ttl: Optional[int] = None):
+        self.path = path
+        self.ttl = ttl
+        self._lock = asyncio.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT, expires_at REAL)"
+        )
+        self._connection.execute(
+            "DELETE FROM fsm WHERE expires_at <= ?", (time.time(),)
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def _make_key(key: StorageKey) -> str:
+        return ':'.join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id,
+            key.business_connection_id, key.destiny
+        ))
+
+    def _expires_at(self) -> Optional[float]:
+        if self.ttl is None:
+            return None
+        return time.time() + self.ttl
+
+    async def _execute(self, query: str, *params: Any) -> list:
+        def execute():
+            rows = self._connection.execute(query, params).fetchall()
+            self._connection.commit()
+            return rows
+
+        async with self._lock:
+            return await asyncio.to_thread(execute)
+
+    async def _get(self, key: StorageKey) -> Optional[tuple]:
+        rows = await self._execute(
+            "SELECT state, data FROM fsm WHERE key = ? "
+            "AND (expires_at IS NULL OR expires_at > ?)",
+            self._make_key(key), time.time()
+        )
+        return rows[0] if rows else None
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        # an expired row is a new conversation, its old data goes too
+        await self._execute(
+            "INSERT INTO fsm (key, state, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "state = excluded.state, expires_at = excluded.expires_at, "
+            "data = CASE WHEN fsm.expires_at <= ? THEN NULL ELSE fsm.data END",
+            self._make_key(key), state, self._expires_at(), time.time()
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await self._get(key)
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._execute(
+            "INSERT INTO fsm (key, data, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "data = excluded.data, expires_at = excluded.expires_at, "
+            "state = CASE WHEN fsm.expires_at <= ? THEN NULL "
+            "ELSE fsm.state END",
+            self._make_key(key), json.dumps(data) if data else None,
+            self._expires_at(), time.time()
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await self._get(key)
+        if row is None or row[1] is None:
+            return {}
+        return json.loads(row[1])
+
+    async def purge_expired(self) -> None:
+        await self._execute(
+            "DELETE FROM fsm WHERE expires_at <= ?", time.time()
+        )
+
+    async def close(self) -> None:
+        await self.purge_expired()
+        self._connection.close()
+
+
+def create_storage(config) -> BaseStorage:
+    storage_type = (config.get('FSM_STORAGE') or 'memory').lower()
+    ttl = int(config.get('FSM_TTL') or 86400)
+
+    if storage_type == 'redis':
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(
+            config['REDIS_URL'], state_ttl=ttl, data_ttl=ttl
+        )
+
+    if storage_type == 'sqlite':
+        return SQLiteStorage(
+            config.get('FSM_SQLITE_PATH') or 'fsm.sqlite3', ttl=ttl
+        )
+
+    if storage_type == 'memory':
+        return MemoryStorage()
+
+    raise ValueError("Unknown FSM_STORAGE: {}".format(storage_type))
+
+
+def create_isolation(storage: BaseStorage) -> BaseEventIsolation:
+    # updates of one chat are handled one at a time, e.g. the photos
+    # of an album all land in the same FSM data
+    if hasattr(storage, 'create_isolation'):
+        return storage.create_isolation()
+    return SimpleEventIsolation()
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+
+from sqlalchemy import text
+
+from database.engine import create_engine
+from metrics import QueryStats, current_query_stats, instrument_engine
+
+
+def run_queries(tmp_path, **settings):
+    config = dict(
+        DATABASE_URL='sqlite:///{}'.format(tmp_path / 'db.sqlite3'),
+        **settings
+    )
+
+    async def scenario():
+        engine = create_engine(config)
+        instrument_engine(engine, config)
+        async with engine.begin() as conn:
+            await conn.execute(text("CREATE TABLE item (name TEXT)"))
+            await conn.execute(
+                text("INSERT INTO item VALUES (:name)"),
+                [dict(name='secret {}'.format(index)) for index in range(3)]
+            )
+
+        stats = QueryStats()
+        current_query_stats.set(stats)
+        async with engine.connect() as conn:
+            await conn.execute(
+                text("SELECT name FROM item WHERE name != :name"),
+                dict(name='nobody')
+            )
+        await engine.dispose()
+        return stats
+
+    return asyncio.run(scenario())
+
+
+# fetched_rows relies on how SQLAlchemy buffers results of the async drivers
+def test_fetched_rows_are_counted(tmp_path):
+    stats = run_queries(tmp_path)
+    assert (stats.queries, stats.rows) == (1, 3)
+
+
+def test_slow_query_log_leaves_out_parameters(tmp_path, caplog):
+    with caplog.at_level(logging.WARNING, logger='database.slow_query'):
+        run_queries(tmp_path, SLOW_QUERY_MS='0')
+    assert "SELECT name FROM item" in caplog.text
+    assert "nobody" not in caplog.text
+
+
+def test_slow_query_parameters_are_opt_in(tmp_path, caplog):
+    with caplog.at_level(logging.WARNING, logger='database.slow_query'):
+        run_queries(tmp_path, SLOW_QUERY_MS='0', SLOW_QUERY_PARAMS='true')
+    assert "nobody" in caplog.text
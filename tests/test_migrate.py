@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+from database.engine import create_engine
+from database.migrate import create_schema, applied_migrations,\
+    migration_files
+from database.models import Base
+
+
+def run_with_engine(tmp_path, scenario):
+    async def run():
+        engine = create_engine(
+            dict(DATABASE_URL='sqlite:///{}'.format(tmp_path / 'db.sqlite3'))
+        )
+        try:
+            async with engine.begin() as conn:
+                return await scenario(conn)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+
+def test_new_database_is_stamped(tmp_path):
+    async def scenario(conn):
+        await create_schema(conn, Base.metadata)
+        return await applied_migrations(conn)
+
+    applied = run_with_engine(tmp_path, scenario)
+    assert applied == {path.name for path in migration_files()}
+
+
+def test_existing_database_is_not_stamped(tmp_path):
+    async def scenario(conn):
+        # bot_user as it was before the migrations, without a unique user_id
+        await conn.execute(text(
+            "CREATE TABLE bot_user "
+            "(id INTEGER PRIMARY KEY, name VARCHAR(128), user_id INTEGER)"
+        ))
+        with pytest.raises(RuntimeError, match='_migrate'):
+            await create_schema(conn, Base.metadata)
+        return await applied_migrations(conn)
+
+    assert run_with_engine(tmp_path, scenario) == set()
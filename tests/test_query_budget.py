@@ -0,0 +1,205 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+from sqlalchemy import insert, select, func
+
+from bench.fake_api import FakeBotAPI
+from bench.run import message_update
+from bench.seed import seed
+from bot import create_bot, create_dispatcher
+from database.engine import create_engine, create_session_pool
+from database.models import User, Wishlist, friendship, user_requests
+from metrics import metrics
+
+
+USER = 1
+
+
+@asynccontextmanager
+async def running_bot(tmp_path):
+    api = FakeBotAPI()
+    await api.start()
+    config = dict(
+        BOT_TOKEN='42:TEST',
+        DATABASE_URL='sqlite:///{}'.format(tmp_path / 'db.sqlite3'),
+        TELEGRAM_API_URL=api.base_url,
+        SEND_GLOBAL_RATE='-1',
+        SEND_CHAT_RATE='-1',
+    )
+    engine = create_engine(config)
+    # users 1..6 in a ring: 1 is friends with 2 and 6, 3, 4 and 5 asked
+    # to be friends with 1
+    await seed(engine, users=6, wishes=3, friends=1)
+    async with engine.begin() as conn:
+        ids = dict((await conn.execute(select(User.user_id, User.id))).all())
+        await conn.execute(insert(user_requests), [
+            dict(user_inc_req_id=ids[USER], requester_id=ids[requester])
+            for requester in (3, 4, 5)
+        ])
+
+    bot = create_bot(config)
+    dp = create_dispatcher(config, engine)
+    async with create_session_pool(engine)() as session:
+        # steady state: the user is already in the cache
+        await User.get_by_user_id(session, USER)
+    try:
+        yield dp, bot, engine
+    finally:
+        # the routers are module level, the next test attaches them again
+        for router in dp.sub_routers:
+            router._parent_router = None
+        await dp.storage.close()
+        await bot.session.close()
+        await engine.dispose()
+        await api.stop()
+
+
+async def feed(dp, bot, text):
+    before = {name: (handler.calls, handler.queries)
+              for name, handler in metrics.handlers.items()}
+    await dp.feed_raw_update(bot, message_update(USER, text))
+    return {
+        name: handler.queries - before.get(name, (0, 0))[1]
+        for name, handler in metrics.handlers.items()
+        if handler.calls != before.get(name, (0, 0))[0]
+    }
+
+
+async def count(engine, table, **where):
+    async with engine.connect() as conn:
+        return await conn.scalar(
+            select(func.count()).select_from(table).filter_by(**where)
+        )
+
+
+# (text, handler, statements it may run)
+FLOWS = {
+    'view_friends': [
+        ("Посмотреть друзей", 'handlers.friends.check_friends', 1),
+    ],
+    'delete_friend': [
+        ("Удалить", 'handlers.friends.delete_friend_reply', 1),
+        ("1", 'handlers.friends.delete_friend', 2),
+    ],
+    'view_requests': [
+        ("Посмотреть входящие заявки", 'handlers.friends.check_requests', 1),
+    ],
+    'accept_request': [
+        ("Принять", 'handlers.friends.accept_request_reply', 1),
+        ("1", 'handlers.friends.accept_friend_request', 3),
+    ],
+    'decline_request': [
+        ("Отклонить", 'handlers.friends.cancel_request_reply', 1),
+        ("1", 'handlers.friends.cancel_friend_request', 2),
+    ],
+    'friend_wishlist': [
+        ("Посмотреть вишлист друга", 'handlers.friends.check_friend', 1),
+        ("1", 'handlers.friends.check_friend_wishlist', 3),
+        ("Посмотреть конкретное желание",
+         'handlers.friends.check_item_friend_wl_reply', 0),
+        ("1", 'handlers.friends.check_item_friend_wl', 1),
+        ("Посмотреть вишлист друга", 'handlers.friends.check_friend', 1),
+        ("1", 'handlers.friends.check_friend_wishlist', 1),
+    ],
+    'own_wishlist': [
+        ("Посмотреть Вишлист", 'handlers.wishlist.view_wishlist', 2),
+        ("Посмотреть конкретное желание",
+         'handlers.wishlist.check_item_wl_reply', 0),
+        ("1", 'handlers.wishlist.check_item_wl', 1),
+        # the same wishlist again comes from the cache
+        ("Посмотреть Вишлист", 'handlers.wishlist.view_wishlist', 0),
+    ],
+    'delete_wish': [
+        ("Удалить из вишлиста",
+         'handlers.wishlist.delete_from_wishlist_reply', 2),
+        ("1", 'handlers.wishlist.delete_from_wishlist', 4),
+    ],
+}
+
+
+@pytest.mark.parametrize('flow', sorted(FLOWS))
+def test_query_budget(tmp_path, flow):
+    async def scenario():
+        async with running_bot(tmp_path) as (dp, bot, engine):
+            for text, expected, budget in FLOWS[flow]:
+                handled = await feed(dp, bot, text)
+                assert list(handled) == [expected], text
+                assert handled[expected] <= budget, \
+                    "{} ran {} statements, budget {}".format(
+                        expected, handled[expected], budget
+                    )
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize('number', ["0", "3", "99"])
+def test_delete_friend_out_of_range(tmp_path, number):
+    async def scenario():
+        async with running_bot(tmp_path) as (dp, bot, engine):
+            friends = await count(engine, friendship)
+            await feed(dp, bot, "Удалить")
+            handled = await feed(dp, bot, number)
+            assert list(handled) == ['handlers.friends.delete_friend']
+            assert await count(engine, friendship) == friends
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize('number', ["0", "4", "99"])
+def test_accept_request_out_of_range(tmp_path, number):
+    async def scenario():
+        async with running_bot(tmp_path) as (dp, bot, engine):
+            await feed(dp, bot, "Принять")
+            await feed(dp, bot, number)
+            assert await count(engine, user_requests) == 3
+
+    asyncio.run(scenario())
+
+
+def test_picks_the_listed_friend(tmp_path):
+    async def scenario():
+        async with running_bot(tmp_path) as (dp, bot, engine):
+            # the list is users 2 and 6, then 2 drops the friendship
+            await feed(dp, bot, "Удалить")
+            async with engine.begin() as conn:
+                ids = dict((await conn.execute(
+                    select(User.user_id, User.id)
+                )).all())
+                await conn.execute(friendship.delete().where(
+                    friendship.c.friend_a_id.in_([ids[USER], ids[2]]),
+                    friendship.c.friend_b_id.in_([ids[USER], ids[2]])
+                ))
+
+            # number 1 is still 2, not whoever is first now
+            await feed(dp, bot, "1")
+            assert await count(engine, friendship,
+                               friend_a_id=ids[USER], friend_b_id=ids[6]) == 1
+
+    asyncio.run(scenario())
+
+
+def test_stale_wishlist_picks_nothing_else(tmp_path):
+    async def scenario():
+        async with running_bot(tmp_path) as (dp, bot, engine):
+            async with engine.connect() as conn:
+                owner_id = await conn.scalar(
+                    select(User.id).filter_by(user_id=USER)
+                )
+                first, second = (await conn.scalars(
+                    select(Wishlist.id).filter_by(user_id=owner_id)
+                    .order_by(Wishlist.id)
+                )).all()[:2]
+
+            await feed(dp, bot, "Посмотреть Вишлист")
+            # another process deletes wish 1, this one still shows it
+            async with engine.begin() as conn:
+                await conn.execute(
+                    Wishlist.__table__.delete().where(Wishlist.id == first)
+                )
+
+            await feed(dp, bot, "Удалить из вишлиста")
+            await feed(dp, bot, "1")
+            assert await count(engine, Wishlist.__table__, id=second) == 1
+
+    asyncio.run(scenario())
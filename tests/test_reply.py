@@ -0,0 +1,111 @@
+import asyncio
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import EditMessageText
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton,\
+    ReplyKeyboardMarkup, KeyboardButton
+
+from reply import Reply, TEXT_LIMIT
+
+
+REPLY_KB = ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text='Меню')]])
+OTHER_KB = ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text='1')]])
+INLINE_KB = InlineKeyboardMarkup(inline_keyboard=[[
+    InlineKeyboardButton(text='➡️', callback_data='next')
+]])
+
+
+class FakeBot:
+    def __init__(self, edit_error=None):
+        self.edit_error = edit_error
+        self.calls = []
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        self.calls.append(('send', text, reply_markup))
+        return text
+
+    async def edit_message_text(self, text, chat_id, message_id,
+                                reply_markup=None):
+        self.calls.append(('edit', text, reply_markup))
+        if self.edit_error is not None:
+            raise TelegramBadRequest(
+                EditMessageText(text=text), self.edit_error
+            )
+        return text
+
+
+def make_reply(bot=None):
+    return Reply(SimpleNamespace(bot=bot, chat=SimpleNamespace(id=1)))
+
+
+def test_texts_are_joined():
+    reply = make_reply().add("a").add("b", REPLY_KB)
+    assert reply.compose() == [("a\n\nb", REPLY_KB)]
+
+
+def test_later_reply_keyboard_wins():
+    reply = make_reply().add("a", REPLY_KB).add("b", OTHER_KB)
+    assert reply.compose() == [("a\n\nb", OTHER_KB)]
+
+
+def test_inline_keyboard_stays_with_its_text():
+    reply = make_reply().add("list", INLINE_KB).add("pick", OTHER_KB)
+    assert reply.compose() == [("list", INLINE_KB), ("pick", OTHER_KB)]
+
+
+def test_inline_keyboard_joins_a_plain_text():
+    reply = make_reply().add("done").add("list", INLINE_KB)
+    assert reply.compose() == [("done\n\nlist", INLINE_KB)]
+
+
+def test_inline_keyboard_does_not_join_a_reply_keyboard():
+    reply = make_reply().add("a", REPLY_KB).add("list", INLINE_KB)
+    assert reply.compose() == [("a", REPLY_KB), ("list", INLINE_KB)]
+
+
+def test_filler_is_dropped_for_a_later_reply_keyboard():
+    reply = make_reply()
+    reply.add("list", INLINE_KB)
+    reply.add("actions", REPLY_KB, filler=True)
+    reply.add("pick", OTHER_KB)
+    assert reply.compose() == [("list", INLINE_KB), ("pick", OTHER_KB)]
+
+
+def test_filler_is_kept_as_the_last_part():
+    reply = make_reply()
+    reply.add("list", INLINE_KB)
+    reply.add("actions", REPLY_KB, filler=True)
+    assert reply.compose() == [("list", INLINE_KB), ("actions", REPLY_KB)]
+
+
+def test_text_limit():
+    long_text = "x" * (TEXT_LIMIT - 2)
+    reply = make_reply().add(long_text).add("y")
+    assert reply.compose() == [(long_text, None), ("y", None)]
+
+    reply = make_reply().add("x" * (TEXT_LIMIT - 3)).add("y")
+    assert len(reply.compose()) == 1
+
+
+def test_send_edits_the_first_inline_part():
+    bot = FakeBot()
+    reply = make_reply(bot).add("list", INLINE_KB).add("pick", OTHER_KB)
+    asyncio.run(reply.send(edit=10))
+    assert bot.calls == [('edit', "list", INLINE_KB),
+                         ('send', "pick", OTHER_KB)]
+
+
+def test_unchanged_edit_is_not_sent_again():
+    bot = FakeBot(edit_error="Bad Request: message is not modified")
+    reply = make_reply(bot).add("list", INLINE_KB)
+    assert asyncio.run(reply.send(edit=10)) == []
+    assert bot.calls == [('edit', "list", INLINE_KB)]
+
+
+def test_failed_edit_falls_back_to_a_new_message():
+    bot = FakeBot(edit_error="Bad Request: message can't be edited")
+    reply = make_reply(bot).add("list", INLINE_KB)
+    asyncio.run(reply.send(edit=10))
+    assert bot.calls == [('edit', "list", INLINE_KB),
+                         ('send', "list", INLINE_KB)]
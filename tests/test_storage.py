@@ -0,0 +1,55 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+from storage import SQLiteStorage
+
+
+KEY = StorageKey(bot_id=42, chat_id=1, user_id=1)
+
+
+def test_expired_record_does_not_come_back(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / 'fsm.sqlite3'), ttl=1)
+        await storage.set_state(KEY, 'AddWish:sending_wish_name')
+        await storage.set_data(KEY, {'name': 'old abandoned wish'})
+
+        await asyncio.sleep(1.2)
+        assert await storage.get_state(KEY) is None
+        assert await storage.get_data(KEY) == {}
+
+        await storage.set_state(KEY, 'AddWish:sending_wish_name')
+        assert await storage.get_data(KEY) == {}
+
+        await storage.update_data(KEY, {'price': 100})
+        assert await storage.get_data(KEY) == {'price': 100}
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_expired_state_does_not_come_back(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / 'fsm.sqlite3'), ttl=1)
+        await storage.set_state(KEY, 'AddWish:sending_wish_name')
+        await storage.set_data(KEY, {'name': 'wish'})
+
+        await asyncio.sleep(1.2)
+        await storage.set_data(KEY, {'name': 'new wish'})
+        assert await storage.get_state(KEY) is None
+        assert await storage.get_data(KEY) == {'name': 'new wish'}
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_live_record_keeps_both_columns(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / 'fsm.sqlite3'), ttl=60)
+        await storage.set_data(KEY, {'name': 'wish'})
+        await storage.set_state(KEY, 'AddWish:sending_wish_price')
+        assert await storage.get_data(KEY) == {'name': 'wish'}
+        assert await storage.get_state(KEY) == 'AddWish:sending_wish_price'
+        await storage.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetUpdates, SendMessage
+
+from middlewares.db import current_session
+from middlewares.throttling import TokenBucket, Limiter, SendScheduler,\
+    REPLY, BROADCAST
+
+
+def test_bucket_starts_full():
+    bucket = TokenBucket(rate=1, capacity=3)
+    for _ in range(3):
+        assert bucket.wait_time() == 0
+        bucket.take()
+    assert 0.9 < bucket.wait_time() <= 1
+
+
+def test_bucket_below_one_token_is_rejected():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0.5, capacity=0.5)
+
+
+def test_pause_holds_tokens_back():
+    bucket = TokenBucket(rate=100, capacity=5)
+    bucket.pause(0.5)
+    assert bucket.wait_time() > 0.45
+    assert not bucket.is_idle()
+
+
+def test_replies_go_before_broadcasts():
+    async def scenario():
+        limiter = Limiter(rate=100, capacity=1)
+        await limiter.acquire()
+        released = []
+
+        async def send(name, priority):
+            await limiter.acquire(priority)
+            released.append(name)
+
+        # queued in this order, the reply still goes first
+        tasks = [asyncio.create_task(send('broadcast 1', BROADCAST)),
+                 asyncio.create_task(send('broadcast 2', BROADCAST))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(send('reply', REPLY)))
+        await asyncio.gather(*tasks)
+        return released
+
+    assert asyncio.run(scenario()) == ['reply', 'broadcast 1', 'broadcast 2']
+
+
+def test_low_global_rate_still_sends():
+    # e.g. BOT_WORKERS=32 with the default 30/s leaves 0.9375/s per worker
+    async def scenario():
+        scheduler = SendScheduler(global_rate=0.9375, chat_rate=1,
+                                  chat_burst=0.5)
+
+        async def make_request(bot, method):
+            return 'sent'
+
+        return await asyncio.wait_for(
+            scheduler(make_request, None, SendMessage(chat_id=1, text='x')),
+            timeout=1
+        )
+
+    assert asyncio.run(scenario()) == 'sent'
+
+
+def test_flood_wait_is_retried():
+    async def scenario():
+        scheduler = SendScheduler(global_rate=-1, chat_rate=100,
+                                  max_retries=2)
+        calls = []
+
+        async def make_request(bot, method):
+            calls.append(time.monotonic())
+            if len(calls) == 1:
+                raise TelegramRetryAfter(method, 'Too Many Requests', 0)
+            return 'sent'
+
+        result = await scheduler(
+            make_request, None, SendMessage(chat_id=1, text='x')
+        )
+        return result, len(calls)
+
+    assert asyncio.run(scenario()) == ('sent', 2)
+
+
+def test_flood_wait_gives_up_after_max_retries():
+    async def scenario():
+        scheduler = SendScheduler(global_rate=-1, chat_rate=100,
+                                  max_retries=1)
+
+        async def make_request(bot, method):
+            raise TelegramRetryAfter(method, 'Too Many Requests', 0)
+
+        await scheduler(make_request, None, SendMessage(chat_id=1, text='x'))
+
+    with pytest.raises(TelegramRetryAfter):
+        asyncio.run(scenario())
+
+
+def test_methods_without_chat_are_not_limited():
+    async def scenario():
+        scheduler = SendScheduler(global_rate=1, chat_rate=1)
+
+        async def make_request(bot, method):
+            return 'done'
+
+        for _ in range(5):
+            assert await scheduler(make_request, None, GetUpdates()) == 'done'
+        assert scheduler.chats == {}
+
+    asyncio.run(scenario())
+
+
+def test_read_transaction_ends_before_sending():
+    class Session:
+        def __init__(self):
+            self.open = True
+
+        def in_transaction(self):
+            return self.open
+
+        async def commit(self):
+            self.open = False
+
+    async def scenario():
+        scheduler = SendScheduler(global_rate=-1, chat_rate=100)
+        session = Session()
+        current_session.set(session)
+        open_while_sending = []
+
+        async def make_request(bot, method):
+            open_while_sending.append(session.open)
+            return 'sent'
+
+        await scheduler(make_request, None, SendMessage(chat_id=1, text='x'))
+        return open_while_sending
+
+    assert asyncio.run(scenario()) == [False]
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import signal
+import socket
+
+import aiohttp
+
+from bench.fake_api import FakeBotAPI
+from bench.run import message_update
+from bench.seed import seed
+from bot import create_bot, create_dispatcher
+from database.engine import create_engine
+from webhook import DrainingRequestHandler, run_webhook
+
+
+SECRET = 'test-secret'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_webhook(tmp_path):
+    async def scenario():
+        # every Bot API call takes a while, the answer is still in flight
+        # when the stop signal comes
+        api = FakeBotAPI(latency=0.3)
+        await api.start()
+        port = free_port()
+        config = dict(
+            BOT_TOKEN='42:TEST',
+            DATABASE_URL='sqlite:///{}'.format(tmp_path / 'db.sqlite3'),
+            TELEGRAM_API_URL=api.base_url,
+            SEND_GLOBAL_RATE='-1',
+            SEND_CHAT_RATE='-1',
+            WEBHOOK_BASE_URL='https://bot.example.com',
+            WEBHOOK_SECRET=SECRET,
+            WEBHOOK_HOST='127.0.0.1',
+            WEBHOOK_PORT=str(port),
+        )
+        engine = create_engine(config)
+        await seed(engine, users=2, wishes=1, friends=1)
+        bot = create_bot(config)
+        dp = create_dispatcher(config, engine)
+        handler = DrainingRequestHandler(
+            dispatcher=dp, bot=bot, secret_token=SECRET
+        )
+        default_sigterm = signal.getsignal(signal.SIGTERM)
+        server = asyncio.create_task(
+            run_webhook(dp, bot, config, handler=handler)
+        )
+        url = 'http://127.0.0.1:{}/webhook'.format(port)
+
+        try:
+            async with aiohttp.ClientSession() as client:
+                # the server is up once it listens for the stop signal
+                while signal.getsignal(signal.SIGTERM) is default_sigterm:
+                    await asyncio.sleep(0.01)
+
+                async with client.post(
+                    url, json=message_update(1, 'Друзья')
+                ) as response:
+                    assert response.status == 401
+                assert not handler._background_feed_update_tasks
+
+                async with client.post(
+                    url, json=message_update(1, 'Друзья'),
+                    headers={'X-Telegram-Bot-Api-Secret-Token': SECRET}
+                ) as response:
+                    assert response.status == 200
+                in_flight = set(handler._background_feed_update_tasks)
+                assert len(in_flight) == 1
+
+            os.kill(os.getpid(), signal.SIGTERM)
+            await asyncio.wait_for(server, timeout=5)
+
+            # the answer was sent before the bot session was closed
+            task, = in_flight
+            assert task.done() and task.exception() is None
+            assert api.calls['sendMessage'] == 1
+        finally:
+            for router in dp.sub_routers:
+                router._parent_router = None
+            server.cancel()
+            await bot.session.close()
+            await engine.dispose()
+            await api.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,22 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from workers import watch_workers
+
+
+def test_dead_worker_stops_the_front():
+    processes = [SimpleNamespace(name='bot-worker-0', exitcode=None),
+                 SimpleNamespace(name='bot-worker-1', exitcode=None)]
+
+    async def scenario():
+        watcher = asyncio.create_task(watch_workers(processes, interval=0.01))
+        await asyncio.sleep(0.05)
+        assert not watcher.done()
+
+        processes[1].exitcode = -9
+        await asyncio.wait_for(watcher, timeout=1)
+
+    with pytest.raises(RuntimeError, match='bot-worker-1 exited with code -9'):
+        asyncio.run(scenario())
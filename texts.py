@@ -12,6 +12,8 @@ texts = {
 
     "view_friend_wl": "Вот Вишлист друга!\n\nНазвание | Цена\n{}\n{}",
 
+    "wl_actions": "⬇️Выберите действие ниже⬇️",
+
     "delete_from_wl": "Выберите <u>номер</u> <b>желания</b>, которое вы хотите удалить",
 
     "create_wl": "Похоже, у вас еще нет <b>Вишлиста.</b>\n\n<b><u>Давайте его создадим!</u></b>",
@@ -34,6 +36,9 @@ texts = {
 
     "add_photo": "Хорошо!\nПришлите фото📷 своего желания",
 
+    "photo_error": "Пришлите <u>фото</u> или картинку файлом, "
+                   "либо нажмите «Без фото»",
+
     "add_link": "И последнее!\nЕсли на желание есть ссылка, пришли её: ",
 
     "confirm_add": "Отлично!✅\nДобавляем?",
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import signal
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler,\
+    setup_application
+from aiohttp import web
+
+
+class DrainingRequestHandler(SimpleRequestHandler):
+    def __init__(self, *args, drain_timeout: float = 30, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.drain_timeout = drain_timeout
+
+    async def drain(self, app: web.Application):
+        # updates are fed in background tasks, let them finish
+        # before the dispatcher and the bot session are closed
+        tasks = set(self._background_feed_update_tasks)
+        if tasks:
+            logging.info("Waiting for %d updates in flight", len(tasks))
+            await asyncio.wait(tasks, timeout=self.drain_timeout)
+
+
+def wait_for_stop_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows, Ctrl+C still cancels the main task
+            pass
+    return stop.wait()
+
+
+async def run_webhook(
+        dp: Dispatcher,
+        bot: Bot,
+        config,
+        handler: Optional[DrainingRequestHandler] = None
+):
+    path = config.get('WEBHOOK_PATH') or '/webhook'
+    secret = config['WEBHOOK_SECRET']
+
+    app = web.Application()
+    if handler is None:
+        handler = DrainingRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            secret_token=secret,
+            drain_timeout=float(config.get('WEBHOOK_DRAIN_TIMEOUT') or 30)
+        )
+    app.on_shutdown.append(handler.drain)
+    handler.register(app, path=path)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(
+        runner,
+        host=config.get('WEBHOOK_HOST') or '0.0.0.0',
+        port=int(config.get('WEBHOOK_PORT') or 8080)
+    )
+    await site.start()
+
+    try:
+        await bot.set_webhook(
+            config['WEBHOOK_BASE_URL'].rstrip('/') + path,
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=config.get('DROP_PENDING_UPDATES') == 'true'
+        )
+        await wait_for_stop_signal()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,240 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import signal
+from functools import partial
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import Update
+from aiogram.utils.backoff import Backoff, BackoffConfig
+from aiohttp import web
+
+from bot import create_bot, create_dispatcher
+from database.engine import create_engine
+from webhook import DrainingRequestHandler, run_webhook, wait_for_stop_signal
+
+
+def shard_key(update: Update):
+    context = UserContextMiddleware.resolve_event_context(update)
+    if context.chat is not None:
+        return context.chat.id
+    if context.user is not None:
+        return context.user.id
+    return update.update_id
+
+
+class UpdateRouter:
+    # all updates of one chat go to the same worker, so the FSM steps
+    # of a conversation are handled in order
+    def __init__(self, queues):
+        self.queues = queues
+
+    def route(self, update: Update, raw: str):
+        key = shard_key(update)
+        self.queues[key % len(self.queues)].put((key, raw))
+
+    def stop(self):
+        for queue in self.queues:
+            queue.put(None)
+
+
+class ShardingRequestHandler(DrainingRequestHandler):
+    def __init__(self, *args, update_router: UpdateRouter, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.update_router = update_router
+
+    async def handle(self, request: web.Request) -> web.Response:
+        bot = await self.resolve_bot(request)
+        secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not self.verify_secret(secret, bot):
+            return web.Response(body="Unauthorized", status=401)
+
+        raw = await request.text()
+        update = Update.model_validate(json.loads(raw), context={"bot": bot})
+        self.update_router.route(update, raw)
+        return web.json_response({})
+
+
+async def poll_updates(dp: Dispatcher, bot: Bot, config, update_router):
+    await bot.delete_webhook(
+        drop_pending_updates=config.get('DROP_PENDING_UPDATES') == 'true'
+    )
+    allowed_updates = dp.resolve_used_update_types()
+    offset = None
+    # the same delays as aiogram's own polling
+    backoff = Backoff(BackoffConfig(
+        min_delay=1.0, max_delay=5.0, factor=1.3, jitter=0.1
+    ))
+
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset, timeout=30, allowed_updates=allowed_updates
+            )
+        except TelegramRetryAfter as e:
+            logging.warning("Flood wait %ss on getUpdates", e.retry_after)
+            await asyncio.sleep(e.retry_after)
+            continue
+        except Exception as e:
+            # a 5xx, a conflict or a network error must not stop every worker
+            logging.warning(
+                "Failed to fetch updates: %s: %s, retrying in %.1fs",
+                type(e).__name__, e, backoff.next_delay
+            )
+            await backoff.asleep()
+            continue
+        backoff.reset()
+
+        for update in updates:
+            update_router.route(
+                update,
+                update.model_dump_json(by_alias=True, exclude_unset=True)
+            )
+            offset = update.update_id + 1
+
+
+async def run_polling_front(dp: Dispatcher, bot: Bot, config, update_router):
+    polling = asyncio.create_task(
+        poll_updates(dp, bot, config, update_router)
+    )
+    stop = asyncio.create_task(wait_for_stop_signal())
+    try:
+        await asyncio.wait({polling, stop}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        polling.cancel()
+        stop.cancel()
+        await dp.storage.close()
+        await bot.session.close()
+    if polling.done() and not polling.cancelled():
+        polling.result()
+
+
+async def feed_in_order(dp: Dispatcher, bot: Bot, update, previous):
+    if previous is not None:
+        await asyncio.wait({previous})
+    try:
+        await dp.feed_raw_update(bot, update)
+    except Exception:
+        logging.exception("Cause exception while process update")
+
+
+def forget_chat(chats, key, task):
+    if chats.get(key) is task:
+        del chats[key]
+
+
+async def run_worker(index, queue, config):
+    bot = create_bot(config)
+    engine = create_engine(config)
+    dp = create_dispatcher(config, engine)
+    chats = {}
+
+    logging.info("Worker %d started", index)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        while True:
+            item = await asyncio.to_thread(queue.get)
+            if item is None:
+                break
+
+            key, raw = item
+            task = asyncio.create_task(
+                feed_in_order(dp, bot, json.loads(raw), chats.get(key))
+            )
+            chats[key] = task
+            task.add_done_callback(partial(forget_chat, chats, key))
+
+        if chats:
+            await asyncio.wait(set(chats.values()))
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+        await engine.dispose()
+        logging.info("Worker %d stopped", index)
+
+
+def worker_process(index, queue, config):
+    # the front process decides when workers stop: Ctrl+C and a service
+    # manager stopping the whole process group reach workers too, they
+    # finish their queue once the front process is done with it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_worker(index, queue, config))
+
+
+def worker_config(config, index):
+    config = dict(config)
+    if config.get('METRICS_PORT'):
+        # the front process keeps METRICS_PORT, workers take the next ones
+        config['METRICS_PORT'] = str(int(config['METRICS_PORT']) + index + 1)
+    # every worker paces its own messages, together they keep the global
+    # rate; a chat always lands on one worker, its rate stays as is
+    global_rate = float(config.get('SEND_GLOBAL_RATE') or 30)
+    if global_rate > 0:
+        config['SEND_GLOBAL_RATE'] = str(
+            global_rate / int(config['BOT_WORKERS'])
+        )
+    return config
+
+
+async def watch_workers(processes, interval=1.0):
+    # A worker that died took the updates of its queue with it, and the
+    # queue itself may be left locked, so it is not restarted. The front
+    # process stops and exits with an error for the service manager
+    while True:
+        for process in processes:
+            if process.exitcode is not None:
+                raise RuntimeError("Worker {} exited with code {}".format(
+                    process.name, process.exitcode
+                ))
+        await asyncio.sleep(interval)
+
+
+async def serve_front(dp: Dispatcher, bot: Bot, config, update_router):
+    if config.get('BOT_MODE') == 'webhook':
+        handler = ShardingRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            secret_token=config['WEBHOOK_SECRET'],
+            update_router=update_router
+        )
+        await run_webhook(dp, bot, config, handler=handler)
+    else:
+        await run_polling_front(dp, bot, config, update_router)
+
+
+async def run_sharded(dp: Dispatcher, bot: Bot, config):
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue() for _ in range(int(config['BOT_WORKERS']))]
+    processes = [
+        context.Process(
+            target=worker_process,
+            args=(index, queue, worker_config(config, index)),
+            name='bot-worker-{}'.format(index)
+        )
+        for index, queue in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+
+    update_router = UpdateRouter(queues)
+    front = asyncio.create_task(serve_front(dp, bot, config, update_router))
+    watcher = asyncio.create_task(watch_workers(processes))
+    try:
+        await asyncio.wait({front, watcher},
+                           return_when=asyncio.FIRST_COMPLETED)
+        if watcher.done():
+            front.cancel()
+            await asyncio.wait({front})
+            watcher.result()
+        front.result()
+    finally:
+        front.cancel()
+        watcher.cancel()
+        update_router.stop()
+        for process in processes:
+            await asyncio.to_thread(process.join)